@@ -0,0 +1,208 @@
+"""
+File with benchmarks of the game, run from the game/ folder
+
+Every map in data/maps/ (and data/maps/test_maps/) is played with scripted inputs, the simulation
+speed in ticks per second, the render times in ms per frame and the time per frame of the main
+subsystems are reported. Results can be written to a JSON file and compared against a stored baseline.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# pylint: disable=wrong-import-position
+import pygame
+from game import Game
+from scripts.inputs import TickInput
+from scripts.profiler import Profiler
+from scripts.tilemap import BASE_TILEMAP_PATH
+
+MAP_DIRECTORIES = ["", "test_maps/"]
+# Level number the benchmarked map is played as, no shipped level uses it
+BENCH_LEVEL = -1
+# Reported ms per frame of the profiler spans of the subsystems
+SUBSYSTEM_SPANS = {"player_update_ms": "player.update", "traps_update_ms": "traps.update", "tilemap_render_ms": "tilemap"}
+
+def time_per_frame(func, frames):
+    """Returns the average time in ms of calling func"""
+    start = time.perf_counter()
+    for _ in range(frames):
+        func()
+    return (time.perf_counter() - start) / frames * 1000
+
+def map_ids():
+    """Returns the ids of all shipped maps, map file names without .json relative to BASE_TILEMAP_PATH"""
+    ids = []
+    for directory in MAP_DIRECTORIES:
+        for name in sorted(os.listdir(BASE_TILEMAP_PATH + directory)):
+            if name.endswith(".json"):
+                ids.append(directory + name[:-len(".json")])
+    return ids
+
+def scripted_input(tick):
+    """Returns the input of tick, walks right with regular jumps and turns around from time to time"""
+    return TickInput(movement=[tick % 240 >= 200, tick % 240 < 180], jump=tick % 40 in {0, 12})
+
+def start_map(game, map_id):
+    """Starts playing map map_id, deaths restart it like a level of the game"""
+    game.current_state = "gameplay"
+    game.level_templates[BENCH_LEVEL] = game.level_template(map_id)
+    game.level_info.level = BENCH_LEVEL
+    game.level_info.level_up = False
+    game.load_level(BENCH_LEVEL)
+    game.display_settings.transition = 0
+
+def play_tick(game, map_id, tick):
+    """Runs one tick of the scripted play of map map_id, restarts the map instead of leveling up"""
+    game.step(scripted_input(tick))
+    if game.level_info.level_up or game.current_state != "gameplay":
+        start_map(game, map_id)
+
+def bench_map(game, map_id, ticks=3000, frames=600):
+    """Measures simulation and rendering of map map_id"""
+    start_map(game, map_id)
+    start = time.perf_counter()
+    for tick in range(ticks):
+        play_tick(game, map_id, tick)
+    ticks_per_second = ticks / (time.perf_counter() - start)
+
+    start_map(game, map_id)
+    render_times = []
+    frame_times = []
+    profiler = game.profiler
+    game.profiler = Profiler(capacity=None)
+    game.profiler.enabled = True
+    for tick in range(frames):
+        frame_start = time.perf_counter()
+        play_tick(game, map_id, tick)
+        render_start = time.perf_counter()
+        game.present(game.draw())
+        frame_end = time.perf_counter()
+        render_times.append((frame_end - render_start) * 1000)
+        frame_times.append((frame_end - frame_start) * 1000)
+    totals = game.profiler.totals()
+    game.profiler = profiler
+
+    results = {
+        "sim_ticks_per_second": ticks_per_second,
+        "render_ms": statistics.fmean(render_times),
+        "frame_ms_p50": statistics.median(frame_times),
+        "frame_ms_p99": statistics.quantiles(frame_times, n=100)[98],
+    }
+    for metric, span in SUBSYSTEM_SPANS.items():
+        results[metric] = totals.get(span, 0) / frames
+    return results
+
+def bench_maps(ticks=3000, frames=600):
+    """Measures every shipped map, returns the results keyed by map id"""
+    game = Game(seed=0)
+    results = {map_id: bench_map(game, map_id, ticks, frames) for map_id in map_ids()}
+    pygame.quit()
+    return results
+
+def bench_present(frames=500):
+    """Measures the final upscale of the display to the window, returns ms per frame for each method"""
+    game = Game()
+    screen = game.display_settings.screen
+    display = game.display_settings.display
+    results = {
+        "scale + blit (allocating)": time_per_frame(lambda: screen.blit(pygame.transform.scale(display, screen.get_size()), (0, 0)), frames)
+    }
+    for scaling in ["nearest", "integer", "smooth"]:
+        game.display_settings.scaling = scaling
+        game.setup_presentation()
+        results[f"scale into window ({scaling})"] = time_per_frame(lambda: game.scale_into(display, game.display_settings.target), frames)
+    pygame.quit()
+    return results
+
+def bench_startup(runs=10):
+    """Measures the startup phases up to the first presented frame, returns ms per phase"""
+    results = {}
+    for _ in range(runs):
+        game = Game()
+        game.present(game.draw())
+        game.startup.mark("first_frame")
+        for phase, ms in game.startup.phases.items():
+            results[phase] = results.get(phase, 0) + ms / runs
+        results["time to first frame"] = results.get("time to first frame", 0) + game.startup.total() / runs
+        pygame.quit()
+    return results
+
+def compare(results, baseline, threshold):
+    """Returns a description of every result worse than baseline by more than threshold (a fraction)"""
+    regressions = []
+    for section, entries in baseline.items():
+        for name, metrics in entries.items():
+            if not isinstance(metrics, dict):
+                metrics = {"ms": metrics}
+            current = results.get(section, {}).get(name)
+            if current is None:
+                continue
+            if not isinstance(current, dict):
+                current = {"ms": current}
+            for metric, old_value in metrics.items():
+                new_value = current.get(metric)
+                if new_value is None or not old_value:
+                    continue
+                # Rates are better when higher, times when lower
+                change = (old_value - new_value) / old_value if metric.endswith("per_second") else (new_value - old_value) / old_value
+                if change > threshold:
+                    regressions.append(f"{section}/{name}/{metric}: {old_value:.3f} -> {new_value:.3f} ({change:+.0%})")
+    return regressions
+
+def print_results(results):
+    """Prints results as a table"""
+    print(f"{'map':16} {'ticks/s':>10} {'render ms':>10} {'p50 ms':>8} {'p99 ms':>8} {'player ms':>10} {'traps ms':>9} {'tilemap ms':>11}")
+    for map_id, metrics in results["maps"].items():
+        print(
+            f"{map_id:16} {metrics['sim_ticks_per_second']:10.0f} {metrics['render_ms']:10.3f} {metrics['frame_ms_p50']:8.3f} {metrics['frame_ms_p99']:8.3f}"
+            f" {metrics['player_update_ms']:10.3f} {metrics['traps_update_ms']:9.3f} {metrics['tilemap_render_ms']:11.3f}"
+        )
+    print()
+    for name, ms in results["present"].items():
+        print(f"{name:32} {ms:.3f} ms/frame")
+    print()
+    for name, ms in results["startup"].items():
+        print(f"{name:32} {ms:.3f} ms")
+
+def main():
+    """Runs the benchmarks, returns the exit code (1 if a regression was found)"""
+    parser = argparse.ArgumentParser(description="Troll Platformer benchmarks")
+    parser.add_argument("--ticks", type=int, default=3000, help="simulated ticks per map")
+    parser.add_argument("--frames", type=int, default=600, help="rendered frames per map")
+    parser.add_argument("--output", metavar="PATH", help="write the results as JSON to PATH")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results against the baseline JSON at PATH")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown against the baseline (fraction)")
+    args = parser.parse_args()
+    if args.frames < 2:
+        parser.error("--frames must be at least 2 to compute the frame time percentiles")
+
+    results = {
+        "maps": bench_maps(args.ticks, args.frames),
+        "present": bench_present(),
+        "startup": bench_startup(),
+    }
+    print_results(results)
+    if args.output:
+        with open(args.output, "wt", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "rt", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print()
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
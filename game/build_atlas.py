@@ -0,0 +1,23 @@
+"""
+File with the asset build step, run from the game/ folder
+
+Packs every image of data/images/ into the texture atlas and its manifest. The game and the editor
+also build the atlas when it is missing or out of date, running this first keeps that off their startup.
+"""
+import os
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+# pylint: disable=wrong-import-position
+from scripts.utils import build_atlas, image_sources, ATLAS_IMAGE_PATH, ATLAS_MANIFEST_PATH
+
+def main():
+    """Builds the texture atlas and prints what was packed"""
+    start = time.perf_counter()
+    manifest, _ = build_atlas(image_sources())
+    print(f"{len(manifest['rects'])} images packed into a {manifest['size'][0]}x{manifest['size'][1]} atlas in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"written {ATLAS_IMAGE_PATH} and {ATLAS_MANIFEST_PATH}")
+
+if __name__ == "__main__":
+    main()
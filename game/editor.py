@@ -4,7 +4,7 @@ File with the level editor
 import sys
 import pygame
 from scripts.tilemap import Tilemap
-from scripts.utils import load_images
+from scripts.utils import load_atlas
 
 SCREEN_WIDTH = 960
 SCREEN_HEIGHT = 800
@@ -21,13 +21,14 @@ class Editor:
         self.display = pygame.Surface((int(SCREEN_WIDTH // RENDER_SCALE), int(SCREEN_HEIGHT // RENDER_SCALE)))
         self.clock = pygame.time.Clock()
 
+        atlas = load_atlas()
         self.assets = {
             "textures": {
-                "grass": load_images("tiles/grass/"),
-                "stone": load_images("tiles/stone/"),
-                "spawners": load_images("tiles/spawners/"),
-                "goal": load_images("tiles/goal/"),
-                "spikes": load_images("tiles/spikes/"),
+                "grass": atlas.images("tiles/grass/"),
+                "stone": atlas.images("tiles/stone/"),
+                "spawners": atlas.images("tiles/spawners/"),
+                "goal": atlas.images("tiles/goal/"),
+                "spikes": atlas.images("tiles/spikes/"),
             },
             "sfx": {
 
@@ -55,6 +56,17 @@ class Editor:
             "ongrid": True
         }
 
+        # Half transparent images of the selected tile keyed by (group, variant)
+        self.previews = {}
+
+    def preview(self):
+        """Returns the half transparent image of the selected tile"""
+        key = (self.tile_selection["group"], self.tile_selection["variant"])
+        if key not in self.previews:
+            img = self.assets["textures"][self.tile_selection["list"][key[0]]][key[1]].copy()
+            img.set_alpha(100)
+            self.previews[key] = img
+        return self.previews[key]
 
     def handle_quit(self, event):
         """Exits the level editor after pressing ESC or closing window"""
@@ -67,7 +79,7 @@ class Editor:
         if event.button == 1:
             self.input_state["clicking"] = True
             if not self.input_state["ongrid"]:
-                self.tilemap.offgrid_tiles.append({"type": self.tile_selection["list"][self.tile_selection["group"]], "variant": self.tile_selection["variant"], "pos": mpos})
+                self.tilemap.add_offgrid({"type": self.tile_selection["list"][self.tile_selection["group"]], "variant": self.tile_selection["variant"], "pos": mpos})
         if event.button == 3:
             self.input_state["right_clicking"] = True
 
@@ -132,8 +144,7 @@ class Editor:
             self.display.fill((162, 242, 252))
             self.tilemap.render(self.display)
 
-            current_tile_img = self.assets["textures"][self.tile_selection["list"][self.tile_selection["group"]]][self.tile_selection["variant"]].copy()
-            current_tile_img.set_alpha(100)
+            current_tile_img = self.preview()
 
             mpos = pygame.mouse.get_pos()
             mpos = (mpos[0] // RENDER_SCALE, mpos[1] // RENDER_SCALE)
@@ -147,15 +158,13 @@ class Editor:
             self.display.blit(current_tile_img, (5, 5))
 
             if self.input_state["clicking"] and self.input_state["ongrid"]:
-                self.tilemap.tilemap[str(tile_pos[0]) + ";" + str(tile_pos[1])] = {"type": self.tile_selection["list"][self.tile_selection["group"]], "variant": self.tile_selection["variant"], "pos": tile_pos}
+                tile = {"type": self.tile_selection["list"][self.tile_selection["group"]], "variant": self.tile_selection["variant"], "pos": tile_pos}
+                if self.tilemap.tilemap.get(tile_pos) != tile:
+                    self.tilemap.set_tile(tile_pos, tile)
             if self.input_state["right_clicking"]:
-                tile_loc = str(tile_pos[0]) + ";" + str(tile_pos[1])
-                self.tilemap.tilemap.pop(tile_loc, None)
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets["textures"][tile["type"]][tile["variant"]]
-                    tile_r = pygame.Rect(tile["pos"][0], tile["pos"][1], tile_img.get_width(), tile_img.get_height())
-                    if tile_r.collidepoint(mpos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                self.tilemap.remove_tile(tile_pos)
+                for tile in self.tilemap.offgrid_at(mpos):
+                    self.tilemap.remove_offgrid(tile)
 
             self.process_events(mpos)
 
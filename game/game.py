@@ -1,26 +1,52 @@
 """
 The main file of the game with Game class
 """
+import io
+import os
 import sys
 import json
+import random
+import time
+import argparse
+import threading
+from functools import partial
 from dataclasses import dataclass, field
 import pygame
 from scripts.entities import Player
 from scripts.tilemap import Tilemap
-from scripts.utils import load_images, Animation
+from scripts.utils import load_atlas, build_masks, Animation
 from scripts.clouds import Clouds
+from scripts.text import TextCache
+from scripts.transition import TransitionFrames
+from scripts.assets import LazyAssets, SilentSound, StartupTimer
+from scripts.inputs import TickInput
+from scripts.profiler import Profiler, PROFILE_ENV
+from scripts.save import AutoSaver, write_atomic, SAVE_PATH, AUTOSAVE_INTERVAL
+from scripts.replay import InputRecorder, load_recording, verify_replay
 from scripts.traps import Traps, Spike, Block
-
-DISAPPEARING_BLOCKS = [
-    ("grass", 9), ("grass", 10), ("grass", 11), ("grass", 12), ("grass", 13), ("grass", 14), ("grass", 15), ("grass", 16), ("grass", 17),
-    ("stone", 9), ("stone", 10), ("stone", 11), ("stone", 12), ("stone", 13), ("stone", 14), ("stone", 15), ("stone", 16), ("stone", 17),
-]
+from scripts.levels import load_template
 
 MAX_LEVEL = 4
 
 SCREEN_WIDTH = 960
 SCREEN_HEIGHT = 800
 RENDER_SCALE = 2.0
+# "nearest" - stretch to the window, "integer" - largest whole multiple centered in the window,
+# "smooth" - stretch with filtering, "sdl" - let SDL scale the window (pygame.SCALED)
+SCALING_MODES = {"nearest", "integer", "smooth", "sdl"}
+
+# Simulation runs at a fixed rate, level_info.time counts these ticks
+TICK_RATE = 60
+# Ticks run at most after one rendered frame, the rest of a longer hitch is dropped
+MAX_CATCH_UP_TICKS = 5
+# Sound effects with their file and volume
+SFX = {
+    "jump": ("data/sfx/jump.wav", 0.6),
+    "select": ("data/sfx/select.wav", 0.6),
+    "start_level": ("data/sfx/start.wav", 0.4),
+    "death": ("data/sfx/death.wav", 0.6),
+}
+MUSIC_PATH = "data/music.ogg"
 
 @dataclass
 class DisplaySettings:
@@ -28,7 +54,17 @@ class DisplaySettings:
     screen: pygame.Surface
     display: pygame.Surface
     clock: pygame.time.Clock
+    scaling: str = "nearest"
+    target: pygame.Surface = None
+    max_fps: int = 60
+    # Frames above the tick rate draw moving objects between their positions of the last two ticks
+    interpolate: bool = False
+    previous: dict = field(default_factory=dict)
+    accumulator: float = 0.0
+    ticks: int = 0
     transition: int = -30
+    frame_key: tuple = None
+    slot_rects: dict = field(default_factory=dict)
 
 @dataclass
 class GameComponents:
@@ -58,99 +94,181 @@ class LevelInfo:
 
 class Game:
     """The main class of the game"""
-    def __init__(self):
-        pygame.init()
-        pygame.display.set_caption("Troll Platformer")
-
+    def __init__(self, scaling="nearest", max_fps=60, headless=False, audio=True, seed=None, profile=None):
+        """Creates the game, headless games have no window and no audio (for tests and tools)"""
+        self.startup = StartupTimer()
+        # Trace path, the profiler is off unless it is given here or in the environment
+        self.profiler = Profiler(profile or os.environ.get(PROFILE_ENV))
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.recorder = None
+        # Started by run, headless games never write the save
+        self.autosaver = None
+        self.last_autosave = 0.0
+        if scaling not in SCALING_MODES:
+            raise ValueError(f"Unknown scaling mode {scaling}")
+
+        if headless:
+            pygame.font.init()
+        else:
+            pygame.init()
+            pygame.display.set_caption("Troll Platformer")
+        self.audio = audio and (pygame.mixer.get_init() is not None)
+        # Contents of the sound effect files, read by the preload thread
+        self.sound_data = {}
+        self.startup.mark("init")
+
+        display_size = (int(SCREEN_WIDTH // RENDER_SCALE), int(SCREEN_HEIGHT // RENDER_SCALE))
+        if headless:
+            screen = None
+            display = pygame.Surface(display_size)
+        elif scaling == "sdl":
+            screen = pygame.display.set_mode(display_size, pygame.SCALED)
+            display = screen
+        else:
+            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            display = pygame.Surface(display_size)
         self.display_settings = DisplaySettings(
-            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT)),
-            display = pygame.Surface((int(SCREEN_WIDTH // RENDER_SCALE), int(SCREEN_HEIGHT // RENDER_SCALE))),
-            clock = pygame.time.Clock()
+            screen = screen,
+            display = display,
+            clock = pygame.time.Clock(),
+            scaling = scaling,
+            max_fps = max_fps,
+            interpolate = max_fps == 0 or max_fps > TICK_RATE
         )
+        self.setup_presentation()
+        self.startup.mark("window")
+
+        atlas = load_atlas()
         self.assets = {
             "textures": {
-                "grass": load_images("tiles/grass/"),
-                "stone": load_images("tiles/stone/"),
-                "clouds": load_images("clouds/"),
-                "goal": load_images("tiles/goal/"),
-                "spikes": load_images("tiles/spikes/"),
+                "grass": atlas.images("tiles/grass/"),
+                "stone": atlas.images("tiles/stone/"),
+                "clouds": atlas.images("clouds/"),
+                "goal": atlas.images("tiles/goal/"),
+                "spikes": atlas.images("tiles/spikes/"),
             },
             "animations": {
-                "player/idle": Animation(load_images("entities/player/idle/"), img_dur=30),
-                "player/walk": Animation(load_images("entities/player/walk/"), img_dur=8),
-                "player/jump": Animation(load_images("entities/player/jump/"), img_dur=5),
-                "player/death": Animation(load_images("entities/player/death/"), img_dur=5),
+                "player/idle": Animation(atlas.images("entities/player/idle/"), img_dur=30),
+                "player/walk": Animation(atlas.images("entities/player/walk/"), img_dur=8),
+                "player/jump": Animation(atlas.images("entities/player/jump/"), img_dur=5),
+                "player/death": Animation(atlas.images("entities/player/death/"), img_dur=5),
             },
-            "sfx": {
-                "jump": pygame.mixer.Sound("data/sfx/jump.wav"),
-                "select": pygame.mixer.Sound("data/sfx/select.wav"),
-                "start_level": pygame.mixer.Sound("data/sfx/start.wav"),
-                "death": pygame.mixer.Sound("data/sfx/death.wav"),
-            },
-            "fonts": {
-                "small": pygame.font.Font("data/fonts/ThaleahFat.ttf", 16),
-                "medium": pygame.font.Font("data/fonts/ThaleahFat.ttf", 32),
-                "large": pygame.font.Font("data/fonts/ThaleahFat.ttf", 48),
-            }
+            "sfx": LazyAssets({name: partial(self.load_sound, path, volume) for name, (path, volume) in SFX.items()}),
+            "fonts": LazyAssets({
+                "small": lambda: pygame.font.Font("data/fonts/ThaleahFat.ttf", 16),
+                "medium": lambda: pygame.font.Font("data/fonts/ThaleahFat.ttf", 32),
+                "large": lambda: pygame.font.Font("data/fonts/ThaleahFat.ttf", 48),
+            }),
         }
-        self.assets["sfx"]["jump"].set_volume(0.6)
-        self.assets["sfx"]["select"].set_volume(0.6)
-        self.assets["sfx"]["start_level"].set_volume(0.4)
-        self.assets["sfx"]["death"].set_volume(0.6)
+        self.startup.mark("textures")
+        with self.profiler.span("build_masks"):
+            self.assets["masks"] = build_masks(self.assets)
+        self.startup.mark("masks")
+        self.text_cache = TextCache(self.assets["fonts"])
+        self.transition_frames = TransitionFrames(self.display_settings.display.get_size())
         self.components = GameComponents(
             player = Player(self, (0, 0), (13, 16)),
             tilemap = Tilemap(self, tile_size=16),
-            clouds = Clouds(self.assets["textures"]["clouds"], self.display_settings.display.get_width(), self.display_settings.display.get_height()),
+            clouds = Clouds(self.assets["textures"]["clouds"], self.display_settings.display.get_width(), self.display_settings.display.get_height(), rng=self.rng),
             traps = Traps(self, [], [])
         )
+        self.level_templates = {}
         self.level_info = LevelInfo()
-        self.movement = [False, False]
+        self.inputs = TickInput()
         self.current_state = "main_menu"
         try:
             self.load_game()
         except FileNotFoundError:
             pass
+        self.startup.mark("save")
+
+    def load_sound(self, path, volume):
+        """Loads the sound effect from path (from memory if it was preloaded), returns a silent sound if the game runs without audio"""
+        if not self.audio:
+            return SilentSound()
+        data = self.sound_data.get(path)
+        sound = pygame.mixer.Sound(path if data is None else io.BytesIO(data))
+        sound.set_volume(volume)
+        return sound
+
+    def preload_assets(self):
+        """Reads the sound effect files into memory, meant to run in a background thread
+
+        Only file contents are read here, pygame sounds and fonts are not thread-safe and are created
+        on the main thread when they are first used.
+        """
+        if not self.audio:
+            return
+        with self.profiler.span("preload"):
+            for path, _volume in SFX.values():
+                with open(path, "rb") as f:
+                    self.sound_data[path] = f.read()
+
+    def start_music(self):
+        """Plays the music in a loop if the game runs with audio"""
+        if self.audio:
+            pygame.mixer.music.load(MUSIC_PATH)
+            pygame.mixer.music.set_volume(0.2)
+            pygame.mixer.music.play(-1)
+
+    @property
+    def movement(self):
+        """Returns the held left and right movement keys"""
+        return self.inputs.movement
 
     def save_game(self):
         """Saves game to data/saves/save.json"""
-        with open("data/saves/save.json", "wt", encoding="utf-8") as f:
-            json.dump(self.level_info.data, f)
+        write_atomic(SAVE_PATH, json.dumps(self.level_info.data))
+
+    def store_progress(self):
+        """Stores the level, time and deaths of the running game in its save slot"""
+        if self.current_state == "gameplay":
+            self.level_info.data["slot" + str(self.level_info.current_slot)]["level"] = self.level_info.level
+            self.level_info.data["slot" + str(self.level_info.current_slot)]["time"] = self.level_info.time
+            self.level_info.data["slot" + str(self.level_info.current_slot)]["deaths"] = self.level_info.deaths
+
+    def autosave(self):
+        """Stores the progress and hands a snapshot of it to the background autosave (if running)"""
+        if self.autosaver is None:
+            return
+        self.store_progress()
+        self.autosaver.submit(self.level_info.data)
+        self.last_autosave = time.perf_counter()
 
     def load_game(self):
         """Loads game from data/saves/save.json"""
-        with open("data/saves/save.json", "rt", encoding="utf-8") as f:
+        with open(SAVE_PATH, "rt", encoding="utf-8") as f:
             data = json.load(f)
         self.level_info.data = data
 
+    def level_template(self, level_id):
+        """Returns the template of level level_id (map file name without .json), the map file is read only the first time"""
+        if level_id not in self.level_templates:
+            self.level_templates[level_id] = load_template(str(level_id) + ".json")
+        return self.level_templates[level_id]
+
     def load_level(self, level_id):
         """Loads level number level_id"""
+        template = self.level_template(level_id)
         self.components.player = Player(self, (0, 0), (13, 16))
-        self.components.tilemap.load(str(level_id) + ".json")
+        self.components.tilemap.load_template(template)
 
-        for spawner in self.components.tilemap.extract([("spawners", 0), ("spawners", 1)], keep=False):
-            if spawner["variant"] in {0, 1}:
-                self.components.player.transform.pos = spawner["pos"]
-                if spawner["variant"] == 1:
-                    self.components.player.transform.flip = True
+        if template.spawn is not None:
+            self.components.player.transform.pos = list(template.spawn[0])
+            self.components.player.transform.flip = template.spawn[1]
 
-        self.components.traps.spikes = []
-        for moving_spike in self.components.tilemap.extract([("spikes", 4), ("spikes", 5), ("spikes", 6), ("spikes", 7)], keep=False):
-            self.components.traps.spikes.append(Spike(moving_spike["pos"], moving_spike["variant"] % 4, self, tile_size=self.components.tilemap.tile_size))
-
-        self.components.traps.blocks = []
-        for disappearing_block in self.components.tilemap.extract(DISAPPEARING_BLOCKS, keep=False):
-            self.components.traps.blocks.append(Block(disappearing_block["pos"], (disappearing_block["type"], disappearing_block["variant"] % 9), self, tile_size=self.components.tilemap.tile_size))
+        self.components.traps.reset(
+            [Spike(list(pos), variant, self, tile_size=template.tile_size) for pos, variant in template.spikes],
+            [Block(list(pos), (block_type, variant), self, tile_size=template.tile_size) for pos, block_type, variant in template.blocks],
+        )
 
         self.level_info.level_up = False
         self.display_settings.transition = -30
 
     def draw_text(self, surf, string, pos, size="medium", color=(255, 255, 255)):
-        """Draws text on surface surf at position pos."""
-        text_surface = self.assets["fonts"][size].render(string, False, color)
-        text_surface_outline = self.assets["fonts"][size].render(string, False, (0, 0, 0))
-        for shift in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-            surf.blit(text_surface_outline, (pos[0] + shift[0], pos[1] + shift[1]))
-        surf.blit(text_surface, pos)
+        """Draws outlined text on surface surf at position pos, returns the affected rect."""
+        return surf.blit(self.text_cache.get(string, size, color), (pos[0] - 1, pos[1] - 1))
 
     def handle_gameplay_input(self):
         """Handles pressed keys while in the gameplay state."""
@@ -159,21 +277,67 @@ class Game:
                 return False
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_a:
-                    self.movement[0] = True
+                    self.inputs.movement[0] = True
                 if event.key == pygame.K_d:
-                    self.movement[1] = True
-                if (event.key in {pygame.K_w, pygame.K_SPACE}) and (not self.display_settings.transition) and (not self.components.player.dead):
-                    self.components.player.jump()
-                if event.key == pygame.K_r and (not self.display_settings.transition) and (not self.components.player.dead):
-                    self.assets["sfx"]["death"].play()
-                    self.components.player.dead = 10
+                    self.inputs.movement[1] = True
+                if event.key in {pygame.K_w, pygame.K_SPACE}:
+                    self.inputs.jump = True
+                if event.key == pygame.K_r:
+                    self.inputs.restart = True
             if event.type == pygame.KEYUP:
                 if event.key == pygame.K_a:
-                    self.movement[0] = False
+                    self.inputs.movement[0] = False
                 if event.key == pygame.K_d:
-                    self.movement[1] = False
+                    self.inputs.movement[1] = False
         return True
 
+    def update_gameplay(self, inputs):
+        """Advances player, traps and clouds by one tick based on inputs"""
+        player = self.components.player
+        if (not self.display_settings.transition) and (not player.dead):
+            if inputs.jump:
+                player.jump()
+            if inputs.restart:
+                self.assets["sfx"]["death"].play()
+                player.dead = 10
+
+        with self.profiler.span("clouds.update"):
+            self.components.clouds.update()
+
+        if (not self.display_settings.transition) and (not player.dead):
+            with self.profiler.span("traps.update"):
+                self.components.traps.update(player.transform.pos, player.transform.size)
+            with self.profiler.span("player.update"):
+                player.update(self.components.tilemap, (inputs.movement[1] - inputs.movement[0], 0), self.components.traps)
+
+    def step(self, inputs):
+        """Advances the game by one tick without touching any surface"""
+        if self.recorder is not None:
+            self.recorder.record(self, inputs)
+        self.display_settings.ticks += 1
+        if self.display_settings.interpolate:
+            self.store_previous_positions()
+        with self.profiler.span("update_transition"):
+            self.update_transition()
+        if self.current_state == "gameplay":
+            self.update_gameplay(inputs)
+            self.level_info.time += 1
+
+    def store_previous_positions(self):
+        """Stores the positions of the moving objects before a tick, frames are interpolated from them"""
+        previous = {cloud: tuple(cloud.pos) for cloud in self.components.clouds.clouds}
+        previous.update((spike, tuple(spike.pos)) for spike in self.components.traps.dashing)
+        previous[self.components.player] = tuple(self.components.player.transform.pos)
+        self.display_settings.previous = previous
+
+    def interpolated(self, obj, pos):
+        """Returns pos of obj moved back towards its position before the last tick by the part of a tick not simulated yet"""
+        previous = self.display_settings.previous.get(obj)
+        if previous is None:
+            return pos
+        alpha = self.display_settings.accumulator * TICK_RATE
+        return (previous[0] + (pos[0] - previous[0]) * alpha, previous[1] + (pos[1] - previous[1]) * alpha)
+
     def update_level_up_transition(self):
         """Updates transition while leveling up or finishing last level"""
         self.display_settings.transition += 1
@@ -189,6 +353,7 @@ class Game:
                 self.level_info.data["slot" + str(self.level_info.current_slot)] = {"level": 0, "time": 0, "deaths": 0}
             else:
                 self.load_level(self.level_info.level)
+            self.autosave()
 
     def update_level_restart_transition(self):
         """Updates transition while restarting level"""
@@ -198,6 +363,7 @@ class Game:
         if self.display_settings.transition > 30:
             self.level_info.deaths += 1
             self.load_level(self.level_info.level)
+            self.autosave()
 
     def update_game_start_transition(self):
         """Updates transition while starting the game"""
@@ -242,50 +408,54 @@ class Game:
 
     def draw_transition(self, surf):
         """Draws the transition circle"""
-        transition_surf = pygame.Surface(surf.get_size())
-        pygame.draw.circle(
-            transition_surf,
-            (255, 255, 255),
-            (surf.get_width() // 2, surf.get_height() // 2),
-            (30 - abs(self.display_settings.transition)) * 12
-        )
-        transition_surf.set_colorkey((255, 255, 255))
-        surf.blit(transition_surf, (0, 0))
+        self.transition_frames.render(surf, self.display_settings.transition)
 
     def draw_gameplay(self):
-        """Draws the gameplay screen"""
+        """Draws the gameplay screen if a tick passed since the last frame, returns the changed rects (None if the whole frame changed)
+
+        With interpolation every frame is drawn, the moving objects are placed between their last two tick positions.
+        """
+        place = self.interpolated if self.display_settings.interpolate else None
+        frame_key = ("gameplay", self.display_settings.ticks, self.display_settings.transition, self.display_settings.accumulator if place else None)
+        if frame_key == self.display_settings.frame_key:
+            return []
+        self.display_settings.frame_key = frame_key
         self.display_settings.display.fill((162, 242, 252))
 
-        self.components.clouds.update()
-        self.components.clouds.render(self.display_settings.display)
+        with self.profiler.span("clouds"):
+            self.components.clouds.render(self.display_settings.display, place)
 
-        self.components.tilemap.render(self.display_settings.display)
+        with self.profiler.span("tilemap"):
+            self.components.tilemap.render(self.display_settings.display)
 
-        if (not self.display_settings.transition) and (not self.components.player.dead):
-            self.components.traps.update(self.components.player.transform.pos, self.components.player.transform.size)
-        self.components.traps.render(self.display_settings.display)
+        with self.profiler.span("traps"):
+            self.components.traps.render(self.display_settings.display, place)
 
-        if (not self.display_settings.transition) and (not self.components.player.dead):
-            self.components.player.update(self.components.tilemap, (self.movement[1] - self.movement[0], 0), self.components.traps)
-        self.components.player.render(self.display_settings.display)
+        with self.profiler.span("player"):
+            player = self.components.player
+            player.render(self.display_settings.display, place(player, player.transform.pos) if place else None)
 
-        seconds = self.level_info.time // 60
-        minutes = seconds // 60
-        seconds = seconds % 60
-        self.draw_text(self.display_settings.display, f"time: {minutes:02}:{seconds:02}", (5, 5), size="small")
-        self.draw_text(self.display_settings.display, f"deaths: {self.level_info.deaths}", (5, 21), size="small")
-        self.draw_text(self.display_settings.display, "restart - r", (self.display_settings.display.get_width() - 90, 5), size="small")
+        with self.profiler.span("text"):
+            seconds = self.level_info.time // TICK_RATE
+            minutes = seconds // 60
+            seconds = seconds % 60
+            self.draw_text(self.display_settings.display, f"time: {minutes:02}:{seconds:02}", (5, 5), size="small")
+            self.draw_text(self.display_settings.display, f"deaths: {self.level_info.deaths}", (5, 21), size="small")
+            self.draw_text(self.display_settings.display, "restart - r", (self.display_settings.display.get_width() - 90, 5), size="small")
 
         if self.display_settings.transition:
-            self.draw_transition(self.display_settings.display)
+            with self.profiler.span("transition"):
+                self.draw_transition(self.display_settings.display)
 
-        self.display_settings.screen.blit(pygame.transform.scale(self.display_settings.display, self.display_settings.screen.get_size()), (0, 0))
+        return None
 
     def handle_menu_input(self):
         """Handles pressed keys while in the main menu state"""
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 return False
+            if event.type in {pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE}:
+                self.display_settings.frame_key = None
             if event.type == pygame.KEYDOWN and (not self.level_info.start_game):
                 if event.key == pygame.K_SPACE:
                     self.assets["sfx"]["start_level"].play()
@@ -295,38 +465,49 @@ class Game:
                     self.level_info.current_slot = max(self.level_info.current_slot - 1, 1)
                     if self.level_info.current_slot != old_slot:
                         self.assets["sfx"]["select"].play()
+                        self.autosave()
                 if event.key == pygame.K_d:
                     old_slot = self.level_info.current_slot
                     self.level_info.current_slot = min(self.level_info.current_slot + 1, 3)
                     if self.level_info.current_slot != old_slot:
                         self.assets["sfx"]["select"].play()
+                        self.autosave()
                 if event.key == pygame.K_DELETE:
                     self.level_info = LevelInfo()
+                    self.autosave()
                 if event.key == pygame.K_p:
                     self.level_info.data["slot" + str(self.level_info.current_slot)] = {"level": 0, "time": 0, "deaths": 0}
+                    self.autosave()
         return True
 
     def draw_menu_slot(self, slot, x_positions):
-        """Draws save slot information on the main menu"""
+        """Draws save slot information on the main menu, remembers the rect it covers"""
         white_color = (255, 255, 255)
         yellow_color = (245, 221, 100)
-        seconds = self.level_info.data["slot" + str(slot)]["time"] // 60
+        seconds = self.level_info.data["slot" + str(slot)]["time"] // TICK_RATE
         minutes = f"{seconds // 60:02}"
         seconds = f"{seconds % 60:02}"
         deaths = f"{self.level_info.data['slot' + str(slot)]['deaths']}"
         level = self.level_info.data["slot" + str(slot)]["level"] + 1
         color = yellow_color if self.level_info.current_slot == slot else white_color
-        self.draw_text(self.display_settings.display, f"Slot {slot}", (x_positions[0], 111), size="large", color=color)
-        self.draw_text(self.display_settings.display, f"Level: {level}", (x_positions[1], 148), size="medium", color=color)
-        self.draw_text(self.display_settings.display, f"Time: {minutes}:{seconds}", (x_positions[2], 178), size="medium", color=color)
-        self.draw_text(self.display_settings.display, f"Deaths: {deaths}", (x_positions[3], 208), size="medium", color=color)
+        rect = self.draw_text(self.display_settings.display, f"Slot {slot}", (x_positions[0], 111), size="large", color=color)
+        rect.union_ip(self.draw_text(self.display_settings.display, f"Level: {level}", (x_positions[1], 148), size="medium", color=color))
+        rect.union_ip(self.draw_text(self.display_settings.display, f"Time: {minutes}:{seconds}", (x_positions[2], 178), size="medium", color=color))
+        rect.union_ip(self.draw_text(self.display_settings.display, f"Deaths: {deaths}", (x_positions[3], 208), size="medium", color=color))
+        self.display_settings.slot_rects[slot] = rect
 
     def draw_menu(self):
-        """Draws main menu"""
+        """Draws main menu if anything changed, returns the changed rects (None if the whole frame changed)"""
+        frame_key = (("main_menu", self.display_settings.transition, repr(self.level_info.data)), self.level_info.current_slot)
+        previous_key = self.display_settings.frame_key
+        if frame_key == previous_key:
+            return []
+        self.display_settings.frame_key = frame_key
+
         self.display_settings.display.fill((162, 242, 252))
 
         if self.level_info.data["best"]["time"] is not None:
-            seconds = self.level_info.data["best"]["time"] // 60
+            seconds = self.level_info.data["best"]["time"] // TICK_RATE
             minutes = f"{seconds // 60:02}"
             seconds = f"{seconds % 60:02}"
             deaths = f"{self.level_info.data['best']['deaths']}"
@@ -338,7 +519,7 @@ class Game:
         self.draw_text(self.display_settings.display, f"Deaths: {deaths}", (27, 49), size="small")
 
         if self.level_info.data["last"]["time"] is not None:
-            seconds = self.level_info.data["last"]["time"] // 60
+            seconds = self.level_info.data["last"]["time"] // TICK_RATE
             minutes = f"{seconds // 60:02}"
             seconds = f"{seconds % 60:02}"
             deaths = f"{self.level_info.data['last']['deaths']}"
@@ -364,25 +545,35 @@ class Game:
         if self.display_settings.transition:
             self.draw_transition(self.display_settings.display)
 
-        self.display_settings.screen.blit(pygame.transform.scale(self.display_settings.display, self.display_settings.screen.get_size()), (0, 0))
+        # Only the highlight moved from one slot to another
+        if (previous_key is not None) and (previous_key[0] == frame_key[0]) and (not self.display_settings.transition):
+            return [self.display_settings.slot_rects[previous_key[1]], self.display_settings.slot_rects[frame_key[1]]]
+        return None
 
     def handle_end_screen_input(self):
         """Handles pressed keys while in the end screen state"""
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 return False
+            if event.type in {pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE}:
+                self.display_settings.frame_key = None
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
                     self.level_info.restart_game = True
         return True
 
     def draw_end_screen(self):
-        """Draws end screen"""
+        """Draws end screen if anything changed, returns the changed rects (None if the whole frame changed)"""
+        frame_key = ("end_screen", self.display_settings.transition, self.level_info.time, self.level_info.deaths)
+        if frame_key == self.display_settings.frame_key:
+            return []
+        self.display_settings.frame_key = frame_key
+
         self.display_settings.display.fill((162, 242, 252))
 
         self.draw_text(self.display_settings.display, "You won!", (156, 134), size="large")
 
-        seconds = self.level_info.time // 60
+        seconds = self.level_info.time // TICK_RATE
         minutes = seconds // 60
         seconds = seconds % 60
         self.draw_text(self.display_settings.display, f"Time: {minutes:02}:{seconds:02}", (138, 178), size="large", color=(245, 221, 100))
@@ -396,41 +587,150 @@ class Game:
         if self.display_settings.transition:
             self.draw_transition(self.display_settings.display)
 
-        self.display_settings.screen.blit(pygame.transform.scale(self.display_settings.display, self.display_settings.screen.get_size()), (0, 0))
+        return None
+
+    def handle_input(self):
+        """Handles pressed keys based on the current state, returns False when the game should exit"""
+        if self.current_state == "main_menu":
+            return self.handle_menu_input()
+        if self.current_state == "gameplay":
+            return self.handle_gameplay_input()
+        return self.handle_end_screen_input()
+
+    def draw(self):
+        """Draws the screen of the current state, returns the changed rects (None if the whole frame changed)"""
+        if self.current_state == "main_menu":
+            return self.draw_menu()
+        if self.current_state == "gameplay":
+            return self.draw_gameplay()
+        return self.draw_end_screen()
+
+    def setup_presentation(self):
+        """Picks the area of the window the display is scaled into"""
+        screen = self.display_settings.screen
+        display = self.display_settings.display
+        if (screen is None) or (self.display_settings.scaling == "sdl"):
+            self.display_settings.target = None
+            return
+
+        if self.display_settings.scaling == "integer":
+            factor = max(1, min(screen.get_width() // display.get_width(), screen.get_height() // display.get_height()))
+            target_rect = pygame.Rect(0, 0, display.get_width() * factor, display.get_height() * factor)
+        else:
+            target_rect = screen.get_rect()
+        target_rect.center = screen.get_rect().center
+        screen.fill((0, 0, 0))
+        self.display_settings.target = screen.subsurface(target_rect.clip(screen.get_rect()))
+
+    def scale_into(self, source, dest):
+        """Scales source directly into dest without allocating a new surface"""
+        if self.display_settings.scaling == "smooth":
+            pygame.transform.smoothscale(source, dest.get_size(), dest)
+        else:
+            pygame.transform.scale(source, dest.get_size(), dest)
+
+    def present(self, rects=None):
+        """Scales the display to the window and shows it, only the display rects in rects if given"""
+        if (self.display_settings.screen is None) or (rects is not None and not rects):
+            return
+        target = self.display_settings.target
+        if target is None:
+            # SDL scales the window itself, the display is the window surface
+            if rects is None:
+                pygame.display.flip()
+            else:
+                pygame.display.update(rects)
+            return
+
+        if rects is None:
+            with self.profiler.span("scale"):
+                self.scale_into(self.display_settings.display, target)
+            with self.profiler.span("flip"):
+                pygame.display.flip()
+            return
+
+        display = self.display_settings.display
+        scale = (target.get_width() / display.get_width(), target.get_height() / display.get_height())
+        offset = target.get_abs_offset()
+        screen_rects = []
+        for rect in rects:
+            left, top = int(rect.left * scale[0]), int(rect.top * scale[1])
+            target_rect = pygame.Rect(left, top, int(rect.right * scale[0]) - left, int(rect.bottom * scale[1]) - top)
+            self.scale_into(display.subsurface(rect), target.subsurface(target_rect))
+            screen_rects.append(target_rect.move(offset))
+        pygame.display.update(screen_rects)
+
+    def advance(self, elapsed):
+        """Runs as many fixed ticks as elapsed real time in seconds allows, returns the number of ticks run"""
+        tick_time = 1 / TICK_RATE
+        self.display_settings.accumulator += elapsed
+        ticks = 0
+        while self.display_settings.accumulator >= tick_time and ticks < MAX_CATCH_UP_TICKS:
+            with self.profiler.span("step"):
+                self.step(self.inputs)
+            self.inputs.jump = False
+            self.inputs.restart = False
+            self.display_settings.accumulator -= tick_time
+            ticks += 1
+        if self.display_settings.accumulator >= tick_time:
+            # The hitch was too long to catch up with, the rest of it is dropped
+            self.display_settings.accumulator %= tick_time
+        return ticks
 
     def run(self):
         """Runs the game, the game loop is here"""
-        pygame.mixer.music.load("data/music.ogg")
-        pygame.mixer.music.set_volume(0.2)
-        pygame.mixer.music.play(-1)
+        self.present(self.draw())
+        self.startup.mark("first_frame")
+        threading.Thread(target=self.preload_assets, daemon=True).start()
+        self.start_music()
+        self.autosaver = AutoSaver()
+        self.last_autosave = time.perf_counter()
 
         running = True
+        previous_time = time.perf_counter()
+        profiler = self.profiler
         while running:
-            self.update_transition()
-            if self.current_state == "main_menu":
-                running = self.handle_menu_input()
-                self.draw_menu()
-            elif self.current_state == "gameplay":
-                running = self.handle_gameplay_input()
-                self.draw_gameplay()
-                self.level_info.time += 1
-            elif self.current_state == "end_screen":
-                running = self.handle_end_screen_input()
-                self.draw_end_screen()
-
-            pygame.display.flip()
-            self.display_settings.clock.tick(60)
-
-        if self.current_state == "gameplay":
-            self.level_info.data["slot" + str(self.level_info.current_slot)]["level"] = self.level_info.level
-            self.level_info.data["slot" + str(self.level_info.current_slot)]["time"] = self.level_info.time
-            self.level_info.data["slot" + str(self.level_info.current_slot)]["deaths"] = self.level_info.deaths
-
+            with profiler.span("frame"):
+                with profiler.span("input"):
+                    running = self.handle_input()
+                current_time = time.perf_counter()
+                with profiler.span("advance"):
+                    self.advance(current_time - previous_time)
+                previous_time = current_time
+                with profiler.span("draw"):
+                    rects = self.draw()
+                with profiler.span("present"):
+                    self.present(rects)
+                with profiler.span("clock"):
+                    self.display_settings.clock.tick(self.display_settings.max_fps)
+                if current_time - self.last_autosave > AUTOSAVE_INTERVAL:
+                    self.autosave()
+
+        self.store_progress()
+        self.autosaver.close()
         self.save_game()
+        if self.recorder is not None and self.recorder.start is not None:
+            self.recorder.save(self)
+        if self.profiler.enabled:
+            self.profiler.dump()
 
         pygame.quit()
         sys.exit()
 
 if __name__ == "__main__":
-    game = Game()
+    parser = argparse.ArgumentParser(description="Troll Platformer")
+    parser.add_argument("--scaling", choices=sorted(SCALING_MODES), default="nearest", help="how the game is scaled to the window")
+    parser.add_argument("--fps", type=int, default=60, help="maximum rendered frames per second, 0 for uncapped")
+    parser.add_argument("--seed", type=int, help="seed of the random number generator")
+    parser.add_argument("--record", metavar="PATH", help="record the inputs of the run to PATH")
+    parser.add_argument("--replay", metavar="PATH", help="replay the recording at PATH headlessly and check it ends in the recorded state")
+    parser.add_argument("--profile", metavar="PATH", help=f"write a Chrome trace of the last frames to PATH on exit (or set {PROFILE_ENV})")
+    args = parser.parse_args()
+    if args.replay:
+        recording = load_recording(args.replay)
+        print(verify_replay(Game(headless=True, audio=False, seed=recording["seed"]), recording))
+        sys.exit()
+    game = Game(scaling=args.scaling, max_fps=args.fps, seed=args.seed, profile=args.profile)
+    if args.record:
+        game.recorder = InputRecorder(game.seed, args.record)
     game.run()
@@ -0,0 +1,62 @@
+"""
+File with the asset registry - lazily loaded assets, silent sounds and startup timing
+"""
+import time
+import threading
+from collections.abc import Mapping
+
+class LazyAssets(Mapping):
+    """Mapping of assets, each asset is loaded by its loader on first access"""
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        asset = self.loaded.get(key)
+        if asset is None:
+            loader = self.loaders[key]
+            with self.lock:
+                if key not in self.loaded:
+                    self.loaded[key] = loader()
+                asset = self.loaded[key]
+        return asset
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def __len__(self):
+        return len(self.loaders)
+
+    def preload(self):
+        """Loads all assets that were not accessed yet"""
+        for key in self.loaders:
+            _ = self[key]
+
+class SilentSound:
+    """Sound that plays nothing, used when the game runs without audio"""
+    def play(self, *args, **kwargs):
+        """Does nothing"""
+
+    def stop(self):
+        """Does nothing"""
+
+    def set_volume(self, value):
+        """Does nothing"""
+
+class StartupTimer:
+    """Class measuring how long each startup phase took"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = {}
+
+    def mark(self, phase):
+        """Ends phase, its duration in ms is stored in self.phases"""
+        now = time.perf_counter()
+        self.phases[phase] = (now - self.last) * 1000
+        self.last = now
+
+    def total(self):
+        """Returns the time in ms since the timer was created until the last finished phase"""
+        return (self.last - self.start) * 1000
@@ -0,0 +1,149 @@
+"""
+File with the batched physics - many independent players stepped at once with NumPy
+
+BatchPhysics mirrors PhysicsEntity/Player movement (jump, horizontal and vertical collision, gravity,
+air state, falling out of the screen and reaching the goal) over arrays, against a dense grid of the
+solid tiles of one tilemap. Only the 3x3 tiles around each player are checked, which gives the same
+result as the merged solid rects of Tilemap for entities up to one tile large. Spikes and traps are
+not simulated.
+"""
+import numpy as np
+from scripts.tilemap import NEIGHBOR_OFFSETS, PHYSICS_TILES
+
+class SolidGrid:
+    """Dense boolean grids of the physics and goal tiles of a tilemap"""
+    def __init__(self, tilemap):
+        self.tile_size = tilemap.tile_size
+        locs = list(tilemap.tilemap) or [(0, 0)]
+        # One empty tile of margin around the map, lookups outside of the grid are empty
+        self.origin = (min(loc[0] for loc in locs) - 1, min(loc[1] for loc in locs) - 1)
+        shape = (max(loc[0] for loc in locs) - self.origin[0] + 2, max(loc[1] for loc in locs) - self.origin[1] + 2)
+        self.solid = np.zeros(shape, dtype=bool)
+        self.goal = np.zeros(shape, dtype=bool)
+        for loc, tile in tilemap.tilemap.items():
+            if tile["type"] in PHYSICS_TILES:
+                self.solid[loc[0] - self.origin[0], loc[1] - self.origin[1]] = True
+            elif tile["type"] == "goal":
+                self.goal[loc[0] - self.origin[0], loc[1] - self.origin[1]] = True
+
+    def lookup(self, grid, tile_x, tile_y):
+        """Returns grid at the tile coordinate arrays tile_x, tile_y, False outside of the grid"""
+        x = tile_x - self.origin[0]
+        y = tile_y - self.origin[1]
+        inside = (x >= 0) & (x < grid.shape[0]) & (y >= 0) & (y < grid.shape[1])
+        return grid[np.where(inside, x, 0), np.where(inside, y, 0)] & inside
+
+class BatchPhysics:
+    """Class stepping count independent players in the same level, state is kept in arrays indexed by player"""
+    def __init__(self, tilemap, count, spawn=(0, 0), size=(13, 16), bounds=(480, 400)):
+        self.grid = SolidGrid(tilemap)
+        self.size = size
+        self.bounds = bounds
+        self.pos = np.tile(np.array(spawn, dtype=np.float64), (count, 1))
+        self.velocity = np.zeros((count, 2), dtype=np.float64)
+        self.flip = np.zeros(count, dtype=bool)
+        self.air_time = np.zeros(count, dtype=np.int64)
+        self.jumps = np.full(count, 2, dtype=np.int64)
+        self.dead = np.zeros(count, dtype=bool)
+        self.goal = np.zeros(count, dtype=bool)
+
+    def jump(self, jumping):
+        """Jumps with the living players in the boolean array jumping that have jumps left"""
+        jumping = jumping & self.jumps.astype(bool) & ~self.dead
+        self.velocity[jumping, 1] = -4
+        self.jumps[jumping] -= 1
+        self.air_time[jumping] = 5
+
+    def solid_rects(self, pos):
+        """Returns the tile rect lefts and tops of the 3x3 neighbours of pos (in NEIGHBOR_OFFSETS order) and whether they are solid"""
+        tile_size = self.grid.tile_size
+        tile_x = np.floor_divide(pos[:, 0], tile_size).astype(np.int64)
+        tile_y = np.floor_divide(pos[:, 1], tile_size).astype(np.int64)
+        for offset in NEIGHBOR_OFFSETS:
+            x = tile_x + offset[0]
+            y = tile_y + offset[1]
+            yield x * tile_size, y * tile_size, self.grid.lookup(self.grid.solid, x, y)
+
+    def collide(self, rect_x, rect_y, tile_left, tile_top):
+        """Returns which entity rects at rect_x, rect_y collide with the tile rects at tile_left, tile_top (pygame.Rect.colliderect)"""
+        tile_size = self.grid.tile_size
+        return (
+            (rect_x < tile_left + tile_size) & (tile_left < rect_x + self.size[0])
+            & (rect_y < tile_top + tile_size) & (tile_top < rect_y + self.size[1])
+        )
+
+    def update_horizontal_pos(self, moving, frame_movement):
+        """Mirrors PhysicsEntity.update_horizontal_pos for the players in moving, returns the left and right collisions"""
+        self.pos[moving, 0] += frame_movement[moving] * 1.6
+        self.pos[moving, 0] = np.clip(self.pos[moving, 0], 0, None)
+        over = moving & (self.pos[:, 0] + self.size[0] > self.bounds[0])
+        self.pos[over, 0] = self.bounds[0] - self.size[0]
+
+        # pygame.Rect truncates float positions towards zero
+        rect_x = np.trunc(self.pos[:, 0]).astype(np.int64)
+        rect_y = np.trunc(self.pos[:, 1]).astype(np.int64)
+        left = np.zeros_like(moving)
+        right = np.zeros_like(moving)
+        for tile_left, tile_top, solid in self.solid_rects(self.pos):
+            hit = moving & solid & self.collide(rect_x, rect_y, tile_left, tile_top)
+            rect_x = np.where(hit & (frame_movement > 0), tile_left - self.size[0], rect_x)
+            rect_x = np.where(hit & (frame_movement < 0), tile_left + self.grid.tile_size, rect_x)
+            right |= hit & (frame_movement > 0)
+            left |= hit & (frame_movement < 0)
+            self.pos[hit, 0] = rect_x[hit]
+        return left, right
+
+    def update_vertical_pos(self, moving, frame_movement):
+        """Mirrors PhysicsEntity.update_vertical_pos for the players in moving, returns the up and down collisions"""
+        self.pos[moving, 1] += frame_movement[moving]
+        self.dead |= moving & (self.pos[:, 1] > self.bounds[1])
+
+        rect_x = np.trunc(self.pos[:, 0]).astype(np.int64)
+        rect_y = np.trunc(self.pos[:, 1]).astype(np.int64)
+        up = np.zeros_like(moving)
+        down = np.zeros_like(moving)
+        for tile_left, tile_top, solid in self.solid_rects(self.pos):
+            hit = moving & solid & self.collide(rect_x, rect_y, tile_left, tile_top)
+            rect_y = np.where(hit & (frame_movement > 0), tile_top - self.size[1], rect_y)
+            rect_y = np.where(hit & (frame_movement < 0), tile_top + self.grid.tile_size, rect_y)
+            down |= hit & (frame_movement > 0)
+            up |= hit & (frame_movement < 0)
+            self.pos[hit, 1] = rect_y[hit]
+        return up, down
+
+    def update_physics(self, moving, up, down):
+        """Mirrors PhysicsEntity.update_physics for the players in moving"""
+        self.velocity[moving, 1] = np.minimum(5, self.velocity[moving, 1] + 0.2)
+        self.velocity[moving & (up | down), 1] = 0
+
+    def check_goal_collision(self, moving):
+        """Mirrors Player.check_goal_collision for the players in moving"""
+        tile_size = self.grid.tile_size
+        center_x = self.pos[:, 0] + self.size[0] // 2
+        center_y = self.pos[:, 1] + self.size[1] // 2
+        tile_x = np.floor_divide(center_x, tile_size).astype(np.int64)
+        tile_y = np.floor_divide(center_y, tile_size).astype(np.int64)
+        goal_x = tile_x * tile_size + tile_size // 2
+        goal_y = tile_y * tile_size + tile_size // 2
+        rect_x = np.trunc(self.pos[:, 0]).astype(np.int64)
+        rect_y = np.trunc(self.pos[:, 1]).astype(np.int64)
+        inside = (rect_x <= goal_x) & (goal_x < rect_x + self.size[0]) & (rect_y <= goal_y) & (goal_y < rect_y + self.size[1])
+        self.goal |= moving & inside & self.grid.lookup(self.grid.goal, tile_x, tile_y)
+
+    def update(self, movement, jumping=None):
+        """Advances every living player that has not reached the goal by one tick, movement holds -1, 0 or 1 per player"""
+        movement = np.asarray(movement)
+        if jumping is not None:
+            self.jump(np.asarray(jumping, dtype=bool) & ~self.goal)
+        moving = ~(self.dead | self.goal)
+        # The horizontal velocity of players is always 0
+        left, right = self.update_horizontal_pos(moving, movement + self.velocity[:, 0])
+        up, down = self.update_vertical_pos(moving, self.velocity[:, 1].copy())
+        self.flip = np.where(moving & (movement > 0), False, np.where(moving & (movement < 0), True, self.flip))
+        self.update_physics(moving, up, down)
+        self.check_goal_collision(moving)
+        self.air_time[moving] += 1
+        grounded = moving & down
+        self.air_time[grounded] = 0
+        self.jumps[grounded] = 2
+        return left, right, up, down
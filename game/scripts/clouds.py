@@ -14,20 +14,21 @@ class Cloud:
         """Updates cloud position"""
         self.pos[0] += self.speed
 
-    def render(self, surf):
-        """Renders cloud on surf"""
-        surf.blit(self.img, (self.pos[0] % (surf.get_width() + self.img.get_width()) - self.img.get_width(), self.pos[1] % (surf.get_height() + self.img.get_height()) - self.img.get_height()))
+    def render(self, surf, pos=None):
+        """Renders cloud on surf, at pos instead of its position if given"""
+        pos = self.pos if pos is None else pos
+        surf.blit(self.img, (pos[0] % (surf.get_width() + self.img.get_width()) - self.img.get_width(), pos[1] % (surf.get_height() + self.img.get_height()) - self.img.get_height()))
 
 class Clouds:
     """Class representing multiple clouds"""
-    def __init__(self, cloud_images, disp_width, disp_height, count=10):
+    def __init__(self, cloud_images, disp_width, disp_height, count=10, rng=random):
         self.clouds = []
         for _ in range(count):
             self.clouds.append(
                 Cloud(
-                    pos = (random.random() * disp_width, random.random() * disp_height),
-                    img = random.choice(cloud_images),
-                    speed = random.random() * 0.05 + 0.05
+                    pos = (rng.random() * disp_width, rng.random() * disp_height),
+                    img = rng.choice(cloud_images),
+                    speed = rng.random() * 0.05 + 0.05
                 )
             )
         self.clouds.sort(key=lambda x: x.speed)
@@ -37,7 +38,7 @@ class Clouds:
         for cloud in self.clouds:
             cloud.update()
 
-    def render(self, surf):
-        """Renders all clouds on surf"""
+    def render(self, surf, place=None):
+        """Renders all clouds on surf, place(cloud, pos) returns the position to draw at if given"""
         for cloud in self.clouds:
-            cloud.render(surf)
+            cloud.render(surf, place(cloud, cloud.pos) if place else None)
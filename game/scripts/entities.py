@@ -1,6 +1,7 @@
 """
 File with entity classes - PhysicsEntity, Player
 """
+import math
 from dataclasses import dataclass, field
 import pygame
 from scripts.traps import Traps
@@ -48,6 +49,10 @@ class PhysicsEntity:
         """Returns the rectangle of the entity"""
         return pygame.Rect(self.transform.pos[0], self.transform.pos[1], self.transform.size[0], self.transform.size[1])
 
+    def mask(self):
+        """Returns the cached collision mask of the current animation frame, the same whichever way the entity faces"""
+        return self.game.assets["masks"][(self.type + "/" + self.anim.action, self.anim.animation.index())]
+
     def clip_horizontal_pos(self):
         """Disables leaving the screen from the left and right side"""
         if self.transform.pos[0] < 0:
@@ -61,7 +66,10 @@ class PhysicsEntity:
         self.clip_horizontal_pos()
 
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.transform.pos):
+        rects = tilemap.physics_rects_near(entity_rect)
+        for i in entity_rect.collidelistall(rects):
+            rect = rects[i]
+            # An earlier collision may have already pushed the entity out of rect
             if entity_rect.colliderect(rect):
                 if frame_movement[0] > 0:
                     entity_rect.right = rect.left
@@ -79,7 +87,9 @@ class PhysicsEntity:
             self.dead = 1
 
         entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.transform.pos):
+        rects = tilemap.physics_rects_near(entity_rect)
+        for i in entity_rect.collidelistall(rects):
+            rect = rects[i]
             if entity_rect.colliderect(rect):
                 if frame_movement[1] > 0:
                     entity_rect.bottom = rect.top
@@ -114,9 +124,9 @@ class PhysicsEntity:
         self.update_physics()
         self.anim.animation.update()
 
-    def render(self, surf):
-        """Renders entity image on surf"""
-        surf.blit(pygame.transform.flip(self.anim.animation.img(), self.transform.flip, False), self.transform.pos)
+    def render(self, surf, pos=None):
+        """Renders entity image on surf, at pos instead of its position if given"""
+        surf.blit(self.anim.animation.img(self.transform.flip), self.transform.pos if pos is None else pos)
 
 class Player(PhysicsEntity):
     """Class for the player entity"""
@@ -128,9 +138,8 @@ class Player(PhysicsEntity):
     def check_goal_collision(self, tilemap):
         """Checks if player reached goal"""
         player_tile = (int((self.transform.pos[0] + self.transform.size[0] // 2) // tilemap.tile_size), int((self.transform.pos[1] + self.transform.size[1] // 2) // tilemap.tile_size))
-        player_tile_str = str(player_tile[0]) + ";" + str(player_tile[1])
-        if player_tile_str in tilemap.tilemap and tilemap.tilemap[player_tile_str]["type"] == "goal":
-            goal = tilemap.tilemap[player_tile_str]
+        goal = tilemap.tilemap.get(player_tile)
+        if goal is not None and goal["type"] == "goal":
             goal_pos = (int(goal["pos"][0] * tilemap.tile_size + tilemap.tile_size // 2), int(goal["pos"][1] * tilemap.tile_size + tilemap.tile_size // 2))
             if self.rect().collidepoint(goal_pos):
                 self.game.assets["sfx"]["start_level"].play()
@@ -139,27 +148,43 @@ class Player(PhysicsEntity):
     def check_static_spike_collision(self, tilemap):
         """Checks if player ran into a static spike"""
         entity_rect = self.rect()
-        entity_mask = pygame.mask.from_surface(self.anim.animation.img())
+        entity_mask = self.mask()
         for variant, rect in tilemap.spikes_rects_around(self.transform.pos):
             if not entity_rect.colliderect(rect):
                 continue
-            spike_mask = pygame.mask.from_surface(self.game.assets["textures"]["spikes"][variant])
+            spike_mask = self.game.assets["masks"][("spikes", variant)]
             if entity_mask.overlap(spike_mask, (rect.x - self.transform.pos[0], rect.y - self.transform.pos[1])):
                 self.dead = 1
 
-    def check_dynamic_spike_collision(self, traps):
-        """Checks if player ran into a moving spike"""
+    def check_dynamic_spike_collision(self, traps, prev_pos=None):
+        """Checks if player ran into a moving spike or a spike passed through the player during the last tick
+
+        If the player moved from prev_pos during the tick both are checked at every pixel of their paths,
+        a spike only hits the player if they were at the same place at the same time.
+        """
+        pos = self.transform.pos
         entity_rect = self.rect()
-        entity_mask = pygame.mask.from_surface(self.anim.animation.img())
-        for spike in traps.spikes:
-            if not spike.dashing:
-                continue
-            spike_rect = spike.rect()
-            if not entity_rect.colliderect(spike_rect):
+        entity_mask = self.mask()
+        moved = prev_pos is not None and prev_pos != pos
+        if moved:
+            entity_rect.union_ip(pygame.Rect(prev_pos[0], prev_pos[1], self.transform.size[0], self.transform.size[1]))
+        for spike in traps.dashing_near(entity_rect):
+            if not moved:
+                spike_rect = spike.swept_rect()
+                if entity_mask.overlap(spike.swept_mask(), (spike_rect.x - pos[0], spike_rect.y - pos[1])):
+                    self.dead = 1
                 continue
             spike_mask = spike.mask()
-            if entity_mask.overlap(spike_mask, (spike_rect.x - self.transform.pos[0], spike_rect.y - self.transform.pos[1])):
-                self.dead = 1
+            steps = max(spike.distance(), math.ceil(max(abs(pos[0] - prev_pos[0]), abs(pos[1] - prev_pos[1]))))
+            for i in range(steps + 1):
+                fraction = i / steps
+                offset = (
+                    int(spike.prev_pos[0] + (spike.pos[0] - spike.prev_pos[0]) * fraction) - (prev_pos[0] + (pos[0] - prev_pos[0]) * fraction),
+                    int(spike.prev_pos[1] + (spike.pos[1] - spike.prev_pos[1]) * fraction) - (prev_pos[1] + (pos[1] - prev_pos[1]) * fraction),
+                )
+                if entity_mask.overlap(spike_mask, offset):
+                    self.dead = 1
+                    break
 
     def update_air_state(self):
         """Updates air time, resets jumps if standing on the ground"""
@@ -179,10 +204,11 @@ class Player(PhysicsEntity):
 
     def update(self, tilemap, movement=(0, 0), traps=Traps(None, [], [])):
         """Updates player position and animation, checks goal and spike collision"""
+        prev_pos = list(self.transform.pos)
         super().update(tilemap, movement=movement)
         self.check_goal_collision(tilemap)
         self.check_static_spike_collision(tilemap)
-        self.check_dynamic_spike_collision(traps)
+        self.check_dynamic_spike_collision(traps, prev_pos)
         if self.dead:
             self.game.assets["sfx"]["death"].play()
         self.update_air_state()
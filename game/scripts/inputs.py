@@ -0,0 +1,24 @@
+"""
+File with the player input of a single simulation tick
+"""
+from dataclasses import dataclass, field
+
+MOVE_LEFT = 1
+MOVE_RIGHT = 2
+JUMP = 4
+RESTART = 8
+
+@dataclass
+class TickInput:
+    """Dataclass storing the player input for one simulation tick"""
+    movement: list[bool] = field(default_factory=lambda: [False, False])
+    jump: bool = False
+    restart: bool = False
+
+def pack_input(inputs):
+    """Returns inputs packed into the bits of a single byte"""
+    return (MOVE_LEFT * inputs.movement[0]) | (MOVE_RIGHT * inputs.movement[1]) | (JUMP * inputs.jump) | (RESTART * inputs.restart)
+
+def unpack_input(bits):
+    """Returns the TickInput packed into bits by pack_input"""
+    return TickInput(movement=[bool(bits & MOVE_LEFT), bool(bits & MOVE_RIGHT)], jump=bool(bits & JUMP), restart=bool(bits & RESTART))
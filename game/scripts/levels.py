@@ -0,0 +1,186 @@
+"""
+File with the LevelTemplate class - levels compiled once and instantiated on every (re)start
+
+Compiled templates are cached next to the map file (data/maps/N.lvl) in a binary format:
+    header - magic, format version, tile size, source mtime (ns), source size, source sha256
+    types - number of tile type names followed by length prefixed utf-8 names
+    tables - grid tiles, offgrid tiles, spawn, spikes and blocks, each a count followed
+             by packed little-endian arrays, one array per column
+"""
+import os
+import sys
+import struct
+import hashlib
+from array import array
+from dataclasses import dataclass
+from types import MappingProxyType
+from scripts.tilemap import Tilemap, BASE_TILEMAP_PATH
+from scripts.save import write_atomic
+
+SPAWNERS = [("spawners", 0), ("spawners", 1)]
+MOVING_SPIKES = [("spikes", 4), ("spikes", 5), ("spikes", 6), ("spikes", 7)]
+DISAPPEARING_BLOCKS = [
+    ("grass", 9), ("grass", 10), ("grass", 11), ("grass", 12), ("grass", 13), ("grass", 14), ("grass", 15), ("grass", 16), ("grass", 17),
+    ("stone", 9), ("stone", 10), ("stone", 11), ("stone", 12), ("stone", 13), ("stone", 14), ("stone", 15), ("stone", 16), ("stone", 17),
+]
+
+COMPILED_EXTENSION = ".lvl"
+COMPILED_MAGIC = b"TPLV"
+COMPILED_VERSION = 2
+HEADER_FORMAT = "<4sHHqq32s"
+# Column formats of the tables: grid (x, y, type, variant), offgrid (x, y, type, variant),
+# spikes (x, y, variant) and blocks (x, y, type, variant). Offgrid tiles are placed at any
+# (also fractional) pixel position, spikes and blocks come from the grid so they are whole pixels.
+GRID_COLUMNS = ("i", "i", "B", "B")
+OFFGRID_COLUMNS = ("d", "d", "B", "B")
+SPIKE_COLUMNS = ("i", "i", "B")
+BLOCK_COLUMNS = ("i", "i", "B", "B")
+SPAWN_FORMAT = "<?ii?"
+
+@dataclass(frozen=True)
+class LevelTemplate:
+    """Immutable dataclass storing everything needed to (re)start a level"""
+    tile_size: int
+    tilemap: MappingProxyType
+    offgrid_tiles: tuple
+    spawn: tuple = None
+    spikes: tuple = ()
+    blocks: tuple = ()
+
+def freeze_tile(tile, pos_type=int):
+    """Returns a read-only copy of tile with its pos converted to pos_type, shared by every instance of a level"""
+    return MappingProxyType({**tile, "pos": tuple(pos_type(coord) for coord in tile["pos"])})
+
+def whole_pixels(pos):
+    """Returns pos rounded to whole pixels as stored in the spawn, spike and block tables"""
+    return tuple(round(coord) for coord in pos)
+
+def compile_level(path):
+    """Loads the map from path and splits it into static tiles, spawn point and trap specs"""
+    tilemap = Tilemap(None)
+    tilemap.load(path)
+
+    spawn = None
+    for spawner in tilemap.extract(SPAWNERS, keep=False):
+        spawn = (whole_pixels(spawner["pos"]), spawner["variant"] == 1)
+
+    spikes = tuple((whole_pixels(spike["pos"]), spike["variant"] % 4) for spike in tilemap.extract(MOVING_SPIKES, keep=False))
+    blocks = tuple((whole_pixels(block["pos"]), block["type"], block["variant"] % 9) for block in tilemap.extract(DISAPPEARING_BLOCKS, keep=False))
+
+    return LevelTemplate(
+        tile_size=tilemap.tile_size,
+        tilemap=MappingProxyType({loc: freeze_tile(tile) for loc, tile in tilemap.tilemap.items()}),
+        offgrid_tiles=tuple(freeze_tile(tile, float) for tile in tilemap.offgrid_tiles.values()),
+        spawn=spawn,
+        spikes=spikes,
+        blocks=blocks,
+    )
+
+def source_digest(path):
+    """Returns the sha256 digest of the file at path"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+def pack_columns(out, codes, rows):
+    """Appends the row count and one packed little-endian array per column to out"""
+    out.append(struct.pack("<I", len(rows)))
+    for i, code in enumerate(codes):
+        column = array(code, (row[i] for row in rows))
+        if sys.byteorder == "big":
+            column.byteswap()
+        out.append(column.tobytes())
+
+def unpack_columns(data, offset, codes):
+    """Reads the tables written by pack_columns from data, returns the rows and the new offset"""
+    count = struct.unpack_from("<I", data, offset)[0]
+    offset += 4
+    columns = []
+    for code in codes:
+        column = array(code)
+        column.frombytes(data[offset:offset + count * column.itemsize])
+        if sys.byteorder == "big":
+            column.byteswap()
+        columns.append(column)
+        offset += count * column.itemsize
+    return list(zip(*columns)), offset
+
+def write_compiled(path, template, source_stat, digest):
+    """Writes template to path in the compiled binary format"""
+    types = sorted({tile["type"] for tile in template.tilemap.values()} | {tile["type"] for tile in template.offgrid_tiles} | {block[1] for block in template.blocks})
+    type_ids = {tile_type: i for i, tile_type in enumerate(types)}
+
+    out = [struct.pack(HEADER_FORMAT, COMPILED_MAGIC, COMPILED_VERSION, template.tile_size, source_stat.st_mtime_ns, source_stat.st_size, digest)]
+    out.append(struct.pack("<H", len(types)))
+    for tile_type in types:
+        name = tile_type.encode("utf-8")
+        out.append(struct.pack("<B", len(name)) + name)
+
+    pack_columns(out, GRID_COLUMNS, [(loc[0], loc[1], type_ids[tile["type"]], tile["variant"]) for loc, tile in template.tilemap.items()])
+    pack_columns(out, OFFGRID_COLUMNS, [(tile["pos"][0], tile["pos"][1], type_ids[tile["type"]], tile["variant"]) for tile in template.offgrid_tiles])
+    if template.spawn is None:
+        out.append(struct.pack(SPAWN_FORMAT, False, 0, 0, False))
+    else:
+        out.append(struct.pack(SPAWN_FORMAT, True, template.spawn[0][0], template.spawn[0][1], template.spawn[1]))
+    pack_columns(out, SPIKE_COLUMNS, [(pos[0], pos[1], variant) for pos, variant in template.spikes])
+    pack_columns(out, BLOCK_COLUMNS, [(pos[0], pos[1], type_ids[block_type], variant) for pos, block_type, variant in template.blocks])
+
+    # Written to a unique temporary file first so a half written file is never read
+    write_atomic(path, b"".join(out))
+
+def read_compiled(data):
+    """Reads a template from data in the compiled binary format, returns the template and the header"""
+    header = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if header[0] != COMPILED_MAGIC or header[1] != COMPILED_VERSION:
+        raise ValueError("Not a compiled level of the current version")
+    offset = struct.calcsize(HEADER_FORMAT)
+
+    types = []
+    for _ in range(struct.unpack_from("<H", data, offset)[0]):
+        length = data[offset + 2]
+        types.append(bytes(data[offset + 3:offset + 3 + length]).decode("utf-8"))
+        offset += 1 + length
+    offset += 2
+
+    grid, offset = unpack_columns(data, offset, GRID_COLUMNS)
+    offgrid, offset = unpack_columns(data, offset, OFFGRID_COLUMNS)
+    has_spawn, spawn_x, spawn_y, spawn_flip = struct.unpack_from(SPAWN_FORMAT, data, offset)
+    offset += struct.calcsize(SPAWN_FORMAT)
+    spikes, offset = unpack_columns(data, offset, SPIKE_COLUMNS)
+    blocks, offset = unpack_columns(data, offset, BLOCK_COLUMNS)
+
+    template = LevelTemplate(
+        tile_size=header[2],
+        tilemap=MappingProxyType({(x, y): freeze_tile({"type": types[type_id], "variant": variant, "pos": (x, y)}) for x, y, type_id, variant in grid}),
+        offgrid_tiles=tuple(freeze_tile({"type": types[type_id], "variant": variant, "pos": (x, y)}, float) for x, y, type_id, variant in offgrid),
+        spawn=((spawn_x, spawn_y), spawn_flip) if has_spawn else None,
+        spikes=tuple(((x, y), variant) for x, y, variant in spikes),
+        blocks=tuple(((x, y), types[type_id], variant) for x, y, type_id, variant in blocks),
+    )
+    return template, header
+
+def load_template(path):
+    """Returns the template of the map at path, uses the compiled cache next to it when it is up to date"""
+    source_path = BASE_TILEMAP_PATH + path
+    compiled_path = os.path.splitext(source_path)[0] + COMPILED_EXTENSION
+    source_stat = os.stat(source_path)
+    digest = None
+    try:
+        # Every table is decoded right away, so the file is read whole instead of memory mapped
+        with open(compiled_path, "rb") as f:
+            template, header = read_compiled(f.read())
+        if (header[3], header[4]) == (source_stat.st_mtime_ns, source_stat.st_size):
+            return template
+        # Modification time changed, the content might not have
+        digest = source_digest(source_path)
+        if header[5] == digest:
+            write_compiled(compiled_path, template, source_stat, digest)
+            return template
+    except (OSError, ValueError, struct.error):
+        pass
+
+    template = compile_level(path)
+    try:
+        write_compiled(compiled_path, template, source_stat, digest or source_digest(source_path))
+    except OSError:
+        pass
+    return template
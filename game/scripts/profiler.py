@@ -0,0 +1,80 @@
+"""
+File with the span profiler - named time spans stored in a ring buffer and exported as Chrome trace events
+"""
+import json
+import time
+import threading
+from collections import deque
+
+# Setting this environment variable to a path enables the profiler, the trace is written there on exit
+PROFILE_ENV = "TROLL_PROFILE"
+# Number of the most recent spans kept
+PROFILE_CAPACITY = 100_000
+
+class NullSpan:
+    """Span that measures nothing, shared by all spans of a disabled profiler"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    """Span measuring the time spent in its with block"""
+    __slots__ = ("events", "name", "start")
+
+    def __init__(self, events, name):
+        self.events = events
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.events.append((self.name, self.start, time.perf_counter_ns(), threading.get_ident()))
+        return False
+
+class Profiler:
+    """Class collecting named spans, disabled (and almost free) when path is None"""
+    def __init__(self, path=None, capacity=PROFILE_CAPACITY):
+        self.path = path
+        self.enabled = bool(path)
+        self.events = deque(maxlen=capacity)
+        self.start = time.perf_counter_ns()
+
+    def span(self, name):
+        """Returns a context manager measuring its block as span name"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self.events, name)
+
+    def totals(self):
+        """Returns the total time in ms of the stored spans of each name"""
+        totals = {}
+        for name, start, end, _thread in list(self.events):
+            totals[name] = totals.get(name, 0) + (end - start) / 1_000_000
+        return totals
+
+    def trace(self):
+        """Returns the stored spans as Chrome trace-event JSON data (times in µs)"""
+        threads = {}
+        events = []
+        for name, start, end, thread in list(self.events):
+            events.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.start) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": 0,
+                "tid": threads.setdefault(thread, len(threads)),
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path=None):
+        """Writes the trace to path (self.path by default), open it in chrome://tracing or Perfetto"""
+        with open(path or self.path, "wt", encoding="utf-8") as f:
+            json.dump(self.trace(), f)
@@ -0,0 +1,90 @@
+"""
+File with deterministic input recording and replay
+
+A recording starts on the tick the player starts the game from the main menu and stores
+one byte of inputs per tick (see scripts.inputs) together with the final state of the run.
+The recording finishes on the first tick of the end screen, the final state is taken there.
+"""
+import json
+import base64
+from scripts.inputs import pack_input, unpack_input
+
+RECORDING_VERSION = 1
+
+def final_state(game):
+    """Returns the state compared at the end of a replay"""
+    return {
+        "state": game.current_state,
+        "level": game.level_info.level,
+        "time": game.level_info.time,
+        "deaths": game.level_info.deaths,
+        "pos": list(game.components.player.transform.pos),
+    }
+
+class InputRecorder:
+    """Class recording the inputs of every tick of a single run"""
+    def __init__(self, seed, path):
+        self.seed = seed
+        self.path = path
+        self.start = None
+        self.inputs = bytearray()
+        self.finished = False
+        self.final = None
+
+    def record(self, game, inputs):
+        """Records inputs of the tick game is about to run, called at the start of Game.step"""
+        if self.start is None:
+            if game.current_state != "main_menu" or not game.level_info.start_game:
+                return
+            slot = game.level_info.current_slot
+            self.start = {
+                "slot": slot,
+                "slot_data": dict(game.level_info.data["slot" + str(slot)]),
+                "transition": game.display_settings.transition,
+            }
+        if game.current_state == "end_screen" and not self.finished:
+            self.finished = True
+            self.final = final_state(game)
+        if not self.finished:
+            self.inputs.append(pack_input(inputs))
+
+    def save(self, game):
+        """Saves the recording together with its final state (the current state of game if unfinished) to self.path"""
+        with open(self.path, "wt", encoding="utf-8") as f:
+            json.dump({
+                "version": RECORDING_VERSION,
+                "seed": self.seed,
+                "start": self.start,
+                "inputs": base64.b64encode(bytes(self.inputs)).decode("ascii"),
+                "final": self.final if self.finished else final_state(game),
+            }, f)
+
+def load_recording(path):
+    """Loads the recording from path"""
+    with open(path, "rt", encoding="utf-8") as f:
+        recording = json.load(f)
+    if recording.get("version") != RECORDING_VERSION:
+        raise ValueError(f"Unsupported recording version {recording.get('version')}")
+    if recording["start"] is None:
+        raise ValueError("The recording does not contain any gameplay")
+    recording["inputs"] = base64.b64decode(recording["inputs"])
+    return recording
+
+def replay(game, recording):
+    """Feeds the recorded inputs to game (created with the recorded seed) as fast as possible"""
+    start = recording["start"]
+    game.current_state = "main_menu"
+    game.level_info.current_slot = start["slot"]
+    game.level_info.data["slot" + str(start["slot"])] = dict(start["slot_data"])
+    game.display_settings.transition = start["transition"]
+    game.level_info.start_game = True
+    for bits in recording["inputs"]:
+        game.step(unpack_input(bits))
+
+def verify_replay(game, recording):
+    """Replays recording on game, raises AssertionError if the final state differs from the recorded one"""
+    replay(game, recording)
+    state = final_state(game)
+    if state != recording["final"]:
+        raise AssertionError(f"Replay diverged: recorded {recording['final']}, replayed {state}")
+    return state
@@ -0,0 +1,79 @@
+"""
+File with saving of the game progress - atomic writes and the background autosave thread
+"""
+import os
+import json
+import tempfile
+import threading
+
+SAVE_PATH = "data/saves/save.json"
+# Seconds between the periodic autosaves while the game runs
+AUTOSAVE_INTERVAL = 30.0
+
+def write_atomic(path, data):
+    """Writes data (text or bytes) to path through a synced temporary file, the file is either the old or the new one after a crash
+
+    The temporary file is unique, processes writing the same path at once do not clobber each other.
+    """
+    directory, name = os.path.split(str(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError:
+        # A failed write (e.g. a full disk) should not leave the temporary file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class AutoSaver:
+    """Class writing save snapshots on a background thread
+
+    Snapshots are serialized when submitted, so the game can change its data right away.
+    Only the newest snapshot waiting for the writer is kept, older ones are dropped.
+    A failed write is counted and the thread keeps waiting for the next snapshot.
+    """
+    def __init__(self, path=SAVE_PATH):
+        self.path = path
+        self.pending = None
+        self.closed = False
+        self.writes = 0
+        self.failures = 0
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, data):
+        """Queues a snapshot of data to be written"""
+        text = json.dumps(data)
+        with self.condition:
+            self.pending = text
+            self.condition.notify()
+
+    def run(self):
+        """Writes the pending snapshots until closed, meant to run in the background thread"""
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                text, self.pending = self.pending, None
+            try:
+                write_atomic(self.path, text)
+            except OSError as error:
+                self.failures += 1
+                self.error = error
+                continue
+            self.writes += 1
+
+    def close(self):
+        """Writes the last pending snapshot and stops the thread"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
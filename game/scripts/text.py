@@ -0,0 +1,43 @@
+"""
+File with the TextCache class
+"""
+from collections import OrderedDict
+import pygame
+
+OUTLINE_SHIFTS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+class TextCache:
+    """Class storing outlined text surfaces, drops the least recently used ones when full"""
+    def __init__(self, fonts, max_size=128):
+        self.fonts = fonts
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def compose(self, string, size, color):
+        """Renders string with a 1 pixel black outline, the text itself starts at (1, 1)"""
+        text_surface = self.fonts[size].render(string, False, color)
+        text_surface_outline = self.fonts[size].render(string, False, (0, 0, 0))
+        surface = pygame.Surface((text_surface.get_width() + 2, text_surface.get_height() + 2), pygame.SRCALPHA)
+        for shift in OUTLINE_SHIFTS:
+            surface.blit(text_surface_outline, (1 + shift[0], 1 + shift[1]))
+        surface.blit(text_surface, (1, 1))
+        surface.set_alpha(255, pygame.RLEACCEL)
+        return surface
+
+    def get(self, string, size, color):
+        """Returns the outlined text surface, renders it only if it is not cached"""
+        key = (string, size, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = self.compose(string, size, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
@@ -2,6 +2,7 @@
 File with the Tilemap class
 """
 import json
+from types import MappingProxyType
 import pygame
 
 AUTOTILE_MAP = {
@@ -16,55 +17,240 @@ AUTOTILE_MAP = {
     tuple(sorted([(-1, 0), (0, -1)])): 8,
 }
 
+# Neighbour of the same type at each shift sets its bit of the autotile mask
+AUTOTILE_SHIFTS = [(1, 0), (-1, 0), (0, -1), (0, 1)]
+# AUTOTILE_MAP indexed by the mask, None for the neighbour sets without a variant
+AUTOTILE_VARIANTS = [
+    AUTOTILE_MAP.get(tuple(sorted(shift for bit, shift in enumerate(AUTOTILE_SHIFTS) if mask >> bit & 1)))
+    for mask in range(16)
+]
+# Variants of the autotiled tiles come in sets of this many, the set (e.g. disappearing blocks) is kept
+AUTOTILE_SET_SIZE = 9
+
 NEIGHBOR_OFFSETS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
 PHYSICS_TILES = {"grass", "stone"}
 AUTOTILE_TILES = {"grass", "stone"}
 BASE_TILEMAP_PATH = "data/maps/"
+CHUNK_SIZE = 256
+# Size in pixels of the cells of the spatial index of the merged solid rects
+SOLID_CELL_SIZE = 64
+
+def index_offgrid(tiles):
+    """Returns the offgrid tiles keyed by id(tile), in their drawing order"""
+    return {id(tile): tile for tile in tiles}
 
 class Tilemap:
-    """Class used for storing and rendering the level maps"""
+    """Class used for storing and rendering the level maps
+
+    Grid tiles are stored in self.tilemap keyed by (x, y) tile coordinates,
+    the "x;y" string keys only exist in the map files. Offgrid tiles are stored in self.offgrid_tiles
+    keyed by id(tile) in drawing order, two of them can share a position. Tiles of a level template
+    are shared and read-only, they are copied by own_tiles before the first change.
+    """
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
         self.tilemap = {}
-        self.offgrid_tiles = []
+        self.offgrid_tiles = {}
+        self.layer = None
+        self.chunks = {}
+        self.dirty = set()
+        # Pixels the grid tile textures of the baked layer reach past their cell (right and down)
+        self.overhang = 0
+        self.solids = None
+        self.offgrid_cells = None
+        self.offgrid_hits = None
+
+    def invalidate(self, region=None):
+        """Discards the baked tile layer and the solid rects, they are built again when needed
+
+        If region (a pixel rect) is given only the chunks of the layer it overlaps are baked again.
+        """
+        self.solids = None
+        if region is None or self.layer is None:
+            self.layer = None
+            self.offgrid_cells = None
+            self.offgrid_hits = None
+            return
+        self.dirty.update(self.chunks_overlapping(region))
+
+    def chunks_overlapping(self, rect, size=CHUNK_SIZE):
+        """Returns the coordinates of all chunks rect overlaps, or of all cells of another size"""
+        return [
+            (cell_x, cell_y)
+            for cell_x in range(int(rect.left // size), int((rect.right - 1) // size) + 1)
+            for cell_y in range(int(rect.top // size), int((rect.bottom - 1) // size) + 1)
+        ]
+
+    def invalidate_tile(self, loc, tile):
+        """Bakes again only the chunks covered by the texture of the grid tile in cell loc"""
+        img = self.game.assets["textures"][tile["type"]][tile["variant"]]
+        self.overhang = max(self.overhang, img.get_width() - self.tile_size, img.get_height() - self.tile_size)
+        self.invalidate(pygame.Rect(loc[0] * self.tile_size, loc[1] * self.tile_size, img.get_width(), img.get_height()))
+
+    def own_tiles(self):
+        """Replaces the read-only tiles of a level template with copies that can be changed"""
+        if isinstance(self.tilemap, MappingProxyType):
+            self.tilemap = {loc: {**tile, "pos": list(tile["pos"])} for loc, tile in self.tilemap.items()}
+        if isinstance(self.offgrid_tiles, MappingProxyType):
+            self.offgrid_tiles = index_offgrid({**tile, "pos": list(tile["pos"])} for tile in self.offgrid_tiles.values())
+            self.offgrid_cells = None
+            self.offgrid_hits = None
+
+    def set_tile(self, loc, tile):
+        """Places tile into the grid cell loc, only the cell is baked again"""
+        self.own_tiles()
+        old_tile = self.tilemap.get(loc)
+        if old_tile is not None:
+            self.invalidate_tile(loc, old_tile)
+        self.tilemap[loc] = tile
+        self.invalidate_tile(loc, tile)
+
+    def remove_tile(self, loc):
+        """Removes and returns the tile in the grid cell loc (None if empty), only the cell is baked again"""
+        self.own_tiles()
+        tile = self.tilemap.pop(loc, None)
+        if tile is not None:
+            self.invalidate_tile(loc, tile)
+        return tile
+
+    def offgrid_rect(self, tile):
+        """Returns the pixel rect covered by the offgrid tile"""
+        img = self.game.assets["textures"][tile["type"]][tile["variant"]]
+        return pygame.Rect(tile["pos"][0], tile["pos"][1], img.get_width(), img.get_height())
+
+    def index_offgrid_tile(self, tile):
+        """Adds the offgrid tile to the chunks and the tile cells it overlaps"""
+        rect = self.offgrid_rect(tile)
+        for cell in self.chunks_overlapping(rect):
+            self.offgrid_cells.setdefault(cell, {})[id(tile)] = tile
+        for cell in self.chunks_overlapping(rect, self.tile_size):
+            self.offgrid_hits.setdefault(cell, {})[id(tile)] = tile
+        return rect
+
+    def build_offgrid_index(self):
+        """Indexes the offgrid tiles by the chunks (for baking) and the tile cells (for hit tests) they overlap
+
+        Each cell keeps its tiles in drawing order.
+        """
+        self.offgrid_cells = {}
+        self.offgrid_hits = {}
+        for tile in self.offgrid_tiles.values():
+            self.index_offgrid_tile(tile)
+
+    def offgrid_in(self, cell):
+        """Returns the offgrid tiles overlapping the chunk cell"""
+        if self.offgrid_cells is None:
+            self.build_offgrid_index()
+        return self.offgrid_cells.get(cell, {}).values()
+
+    def offgrid_at(self, pos):
+        """Returns the offgrid tiles covering the pixel position pos"""
+        if self.offgrid_hits is None:
+            self.build_offgrid_index()
+        cell = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        return [tile for tile in self.offgrid_hits.get(cell, {}).values() if self.offgrid_rect(tile).collidepoint(pos)]
+
+    def add_offgrid(self, tile):
+        """Adds an offgrid tile, only the chunks it overlaps are baked again"""
+        self.own_tiles()
+        if self.offgrid_cells is None:
+            self.build_offgrid_index()
+        self.offgrid_tiles[id(tile)] = tile
+        self.invalidate(self.index_offgrid_tile(tile))
+
+    def remove_offgrid(self, tile):
+        """Removes an offgrid tile, only the chunks it overlapped are baked again"""
+        self.own_tiles()
+        if self.offgrid_cells is None:
+            self.build_offgrid_index()
+        del self.offgrid_tiles[id(tile)]
+        rect = self.offgrid_rect(tile)
+        for cell in self.chunks_overlapping(rect):
+            del self.offgrid_cells[cell][id(tile)]
+        for cell in self.chunks_overlapping(rect, self.tile_size):
+            del self.offgrid_hits[cell][id(tile)]
+        self.invalidate(rect)
 
     def extract(self, id_pairs, keep=False):
         """Returns all tiles with corresponding id_pairs"""
+        if not keep:
+            self.own_tiles()
         matches = []
-        for tile in self.offgrid_tiles.copy():
+        for tile in list(self.offgrid_tiles.values()):
             if (tile["type"], tile["variant"]) in id_pairs:
-                matches.append(tile.copy())
+                matches.append({**tile, "pos": list(tile["pos"])})
                 if not keep:
-                    self.offgrid_tiles.remove(tile)
+                    del self.offgrid_tiles[id(tile)]
         for loc, tile in self.tilemap.copy().items():
             if (tile["type"], tile["variant"]) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]["pos"] = matches[-1]["pos"].copy()
+                matches.append({**tile, "pos": list(tile["pos"])})
                 matches[-1]["pos"][0] *= self.tile_size
                 matches[-1]["pos"][1] *= self.tile_size
                 if not keep:
                     self.tilemap.pop(loc, None)
+        if matches and not keep:
+            self.invalidate()
         return matches
 
     def tiles_around(self, pos):
         """Returns the 9 tiles around pos"""
         tiles = []
-        tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        tile_x = int(pos[0] // self.tile_size)
+        tile_y = int(pos[1] // self.tile_size)
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ";" + str(tile_loc[1] + offset[1])
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            tile = self.tilemap.get((tile_x + offset[0], tile_y + offset[1]))
+            if tile is not None:
+                tiles.append(tile)
         return tiles
 
-    def physics_rects_around(self, pos):
-        """Returns the rects of physics tiles around pos"""
+    def merge_solids(self):
+        """Returns the physics tiles merged greedily into maximal rects, each row run is extended down as far as possible"""
+        solid = {loc for loc, tile in self.tilemap.items() if tile["type"] in PHYSICS_TILES}
         rects = []
-        for tile in self.tiles_around(pos):
-            if tile["type"] in PHYSICS_TILES:
-                rects.append(pygame.Rect(tile["pos"][0] * self.tile_size, tile["pos"][1] * self.tile_size, self.tile_size, self.tile_size))
+        for tile_x, tile_y in sorted(solid, key=lambda loc: (loc[1], loc[0])):
+            if (tile_x, tile_y) not in solid:
+                continue
+            width = 1
+            while (tile_x + width, tile_y) in solid:
+                width += 1
+            height = 1
+            while all((tile_x + i, tile_y + height) in solid for i in range(width)):
+                height += 1
+            for i in range(width):
+                for j in range(height):
+                    solid.discard((tile_x + i, tile_y + j))
+            rects.append(pygame.Rect(tile_x * self.tile_size, tile_y * self.tile_size, width * self.tile_size, height * self.tile_size))
         return rects
 
+    def build_solids(self):
+        """Merges the physics tiles and indexes the merged rects by the SOLID_CELL_SIZE cells they overlap"""
+        rects = self.merge_solids()
+        cells = {}
+        for i, rect in enumerate(rects):
+            for cell_x in range(rect.left // SOLID_CELL_SIZE, (rect.right - 1) // SOLID_CELL_SIZE + 1):
+                for cell_y in range(rect.top // SOLID_CELL_SIZE, (rect.bottom - 1) // SOLID_CELL_SIZE + 1):
+                    cells.setdefault((cell_x, cell_y), []).append(i)
+        self.solids = (rects, cells, {cell: [rects[i] for i in indices] for cell, indices in cells.items()})
+
+    def physics_rects_near(self, rect):
+        """Returns the merged solid rects that may collide with rect, in the order they were merged
+
+        The rects are built when a level is loaded, after the tiles change they are built again here.
+        """
+        if self.solids is None:
+            self.build_solids()
+        rects, cells, cell_rects = self.solids
+        left, right = rect.left // SOLID_CELL_SIZE, (rect.right - 1) // SOLID_CELL_SIZE
+        top, bottom = rect.top // SOLID_CELL_SIZE, (rect.bottom - 1) // SOLID_CELL_SIZE
+        if left == right and top == bottom:
+            return cell_rects.get((left, top), [])
+        found = set()
+        for cell_x in range(left, right + 1):
+            for cell_y in range(top, bottom + 1):
+                found.update(cells.get((cell_x, cell_y), ()))
+        return [rects[i] for i in sorted(found)]
+
     def spikes_rects_around(self, pos):
         """Returns the rects of spike tiles around pos"""
         rects = []
@@ -73,37 +259,129 @@ class Tilemap:
                 rects.append((tile["variant"], pygame.Rect(tile["pos"][0] * self.tile_size, tile["pos"][1] * self.tile_size, self.tile_size, self.tile_size)))
         return rects
 
-    def autotile(self):
-        """Changes tile variant based on tiles around it"""
-        for tile in self.tilemap.values():
-            neighbors = set()
-            for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
-                check_loc = str(tile["pos"][0] + shift[0]) + ";" + str(tile["pos"][1] + shift[1])
-                if check_loc not in self.tilemap:
-                    continue
-                if self.tilemap[check_loc]["type"] == tile["type"]:
-                    neighbors.add(shift)
-            neighbors = tuple(sorted(neighbors))
-            if (tile["type"] in AUTOTILE_TILES) and (neighbors in AUTOTILE_MAP):
-                tile["variant"] = AUTOTILE_MAP[neighbors]
+    def autotile_variant(self, loc, tile):
+        """Returns the variant tile gets by autotiling in the grid cell loc"""
+        if tile["type"] not in AUTOTILE_TILES:
+            return tile["variant"]
+        mask = 0
+        for bit, shift in enumerate(AUTOTILE_SHIFTS):
+            neighbor = self.tilemap.get((loc[0] + shift[0], loc[1] + shift[1]))
+            if neighbor is not None and neighbor["type"] == tile["type"]:
+                mask |= 1 << bit
+        variant = AUTOTILE_VARIANTS[mask]
+        if variant is None:
+            return tile["variant"]
+        return tile["variant"] - tile["variant"] % AUTOTILE_SET_SIZE + variant
+
+    def autotile(self, locs=None):
+        """Changes tile variant based on tiles around it
+
+        If locs (grid cells) are given only they and their neighbours are autotiled and baked again.
+        """
+        self.own_tiles()
+        if locs is None:
+            cells = list(self.tilemap)
+        else:
+            cells = {(loc[0] + shift[0], loc[1] + shift[1]) for loc in locs for shift in AUTOTILE_SHIFTS + [(0, 0)]}
+        for loc in cells:
+            tile = self.tilemap.get(loc)
+            if tile is None:
+                continue
+            variant = self.autotile_variant(loc, tile)
+            if variant == tile["variant"]:
+                continue
+            if locs is None:
+                tile["variant"] = variant
+            else:
+                self.invalidate_tile(loc, tile)
+                tile["variant"] = variant
+                self.invalidate_tile(loc, tile)
+        if locs is None:
+            self.invalidate()
 
     def save(self, path):
         """Saves the tilemap to directory path"""
         with open(BASE_TILEMAP_PATH + path, "wt", encoding="utf-8") as f:
-            json.dump({"tilemap": self.tilemap, "tile_size": self.tile_size, "offgrid": self.offgrid_tiles}, f)
+            json.dump({"tilemap": {str(loc[0]) + ";" + str(loc[1]): dict(tile) for loc, tile in self.tilemap.items()}, "tile_size": self.tile_size, "offgrid": [dict(tile) for tile in self.offgrid_tiles.values()]}, f)
 
     def load(self, path):
         """Loads the tilemap from directory path"""
         with open(BASE_TILEMAP_PATH + path, "rt", encoding="utf-8") as f:
             map_data = json.load(f)
-        self.tilemap = map_data["tilemap"]
+        self.tilemap = {}
+        for loc, tile in map_data["tilemap"].items():
+            tile_x, tile_y = loc.split(";")
+            self.tilemap[(int(tile_x), int(tile_y))] = tile
         self.tile_size = map_data["tile_size"]
-        self.offgrid_tiles = map_data["offgrid"]
+        self.offgrid_tiles = index_offgrid(map_data["offgrid"])
+        self.invalidate()
+        self.build_solids()
 
-    def render(self, surf):
-        """Renders the tilemap on surf"""
-        for tile in self.offgrid_tiles:
-            surf.blit(self.game.assets["textures"][tile["type"]][tile["variant"]], tile["pos"])
+    def load_template(self, template):
+        """Uses the static tiles of a level template, keeps the baked layer if the template is already in use"""
+        if self.tilemap is template.tilemap:
+            return
+        self.tilemap = template.tilemap
+        self.tile_size = template.tile_size
+        self.offgrid_tiles = MappingProxyType(index_offgrid(template.offgrid_tiles))
+        self.invalidate()
+        # Built with the level instead of on the first collision query of the first gameplay frame
+        self.build_solids()
 
+    def bake_tile(self, chunks, img, pos):
+        """Blits img at pixel position pos into every chunk it overlaps"""
+        for chunk_x in range(int(pos[0] // CHUNK_SIZE), int((pos[0] + img.get_width() - 1) // CHUNK_SIZE) + 1):
+            for chunk_y in range(int(pos[1] // CHUNK_SIZE), int((pos[1] + img.get_height() - 1) // CHUNK_SIZE) + 1):
+                if (chunk_x, chunk_y) not in chunks:
+                    chunks[(chunk_x, chunk_y)] = pygame.Surface((CHUNK_SIZE, CHUNK_SIZE), pygame.SRCALPHA)
+                chunks[(chunk_x, chunk_y)].blit(img, (pos[0] - chunk_x * CHUNK_SIZE, pos[1] - chunk_y * CHUNK_SIZE))
+
+    def bake(self):
+        """Pre-renders all tiles into a layer of chunk surfaces"""
+        chunks = {}
+        for tile in self.offgrid_tiles.values():
+            self.bake_tile(chunks, self.game.assets["textures"][tile["type"]][tile["variant"]], tile["pos"])
+
+        self.overhang = 0
         for tile in self.tilemap.values():
-            surf.blit(self.game.assets["textures"][tile["type"]][tile["variant"]], (tile["pos"][0] * self.tile_size, tile["pos"][1] * self.tile_size))
+            img = self.game.assets["textures"][tile["type"]][tile["variant"]]
+            self.overhang = max(self.overhang, img.get_width() - self.tile_size, img.get_height() - self.tile_size)
+            self.bake_tile(chunks, img, (tile["pos"][0] * self.tile_size, tile["pos"][1] * self.tile_size))
+
+        for chunk in chunks.values():
+            # Run-length encoding makes blitting the mostly transparent chunks much cheaper
+            chunk.set_alpha(255, pygame.RLEACCEL)
+        self.chunks = chunks
+        self.dirty = set()
+        self.layer = [(chunk, (loc[0] * CHUNK_SIZE, loc[1] * CHUNK_SIZE)) for loc, chunk in chunks.items()]
+
+    def rebake_chunk(self, loc):
+        """Pre-renders the tiles of one chunk again, also the parts of the tiles that cross its borders"""
+        # A fresh surface, drawing into a run-length encoded one decodes it on every blit
+        chunk = pygame.Surface((CHUNK_SIZE, CHUNK_SIZE), pygame.SRCALPHA)
+        origin = (loc[0] * CHUNK_SIZE, loc[1] * CHUNK_SIZE)
+        for tile in self.offgrid_in(loc):
+            chunk.blit(self.game.assets["textures"][tile["type"]][tile["variant"]], (tile["pos"][0] - origin[0], tile["pos"][1] - origin[1]))
+
+        # Cells of the grid tiles whose textures can overlap the chunk, like in bake_tile
+        cells_x = range((origin[0] - self.overhang) // self.tile_size, (origin[0] + CHUNK_SIZE - 1) // self.tile_size + 1)
+        cells_y = range((origin[1] - self.overhang) // self.tile_size, (origin[1] + CHUNK_SIZE - 1) // self.tile_size + 1)
+        for tile_x in cells_x:
+            for tile_y in cells_y:
+                tile = self.tilemap.get((tile_x, tile_y))
+                if tile is not None:
+                    chunk.blit(self.game.assets["textures"][tile["type"]][tile["variant"]], (tile_x * self.tile_size - origin[0], tile_y * self.tile_size - origin[1]))
+
+        chunk.set_alpha(255, pygame.RLEACCEL)
+        self.chunks[loc] = chunk
+
+    def render(self, surf):
+        """Renders the tilemap on surf"""
+        if self.layer is None:
+            self.bake()
+        elif self.dirty:
+            for loc in self.dirty:
+                self.rebake_chunk(loc)
+            self.dirty = set()
+            self.layer = [(chunk, (loc[0] * CHUNK_SIZE, loc[1] * CHUNK_SIZE)) for loc, chunk in self.chunks.items()]
+        surf.blits(self.layer, doreturn=False)
@@ -0,0 +1,30 @@
+"""
+File with the TransitionFrames class
+"""
+import pygame
+
+class TransitionFrames:
+    """Class storing the frames of the circle transition, each frame is rendered only once"""
+    def __init__(self, size, max_value=30):
+        self.size = size
+        self.max_value = max_value
+        self.frames = {}
+
+    def render_frame(self, value):
+        """Renders the frame for transition value, black everywhere except for a circle in the middle"""
+        frame = pygame.Surface(self.size)
+        pygame.draw.circle(frame, (255, 255, 255), (self.size[0] // 2, self.size[1] // 2), (self.max_value - abs(value)) * 12)
+        frame.set_colorkey((255, 255, 255), pygame.RLEACCEL)
+        return frame
+
+    def get(self, value):
+        """Returns the frame for transition value, frames for value and -value are the same"""
+        frame = self.frames.get(abs(value))
+        if frame is None:
+            frame = self.render_frame(value)
+            self.frames[abs(value)] = frame
+        return frame
+
+    def render(self, surf, value):
+        """Renders the frame for transition value on surf"""
+        surf.blit(self.get(value), (0, 0))
@@ -3,57 +3,111 @@ File with the traps of the game - moving spikes, disappearing blocks
 """
 import math
 import pygame
+from scripts.utils import sweep_mask
+
+# Size in pixels of the cells of the spatial index of the trigger zones
+TRAP_CELL_SIZE = 64
+# Movement directions of the spike variants - up, right, down, left
+DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+
+def cells_overlapping(left, top, right, bottom):
+    """Returns the TRAP_CELL_SIZE cells overlapped by the bounds (left, top, right, bottom)"""
+    return [
+        (cell_x, cell_y)
+        for cell_x in range(int(left // TRAP_CELL_SIZE), int(right // TRAP_CELL_SIZE) + 1)
+        for cell_y in range(int(top // TRAP_CELL_SIZE), int(bottom // TRAP_CELL_SIZE) + 1)
+    ]
 
 class Spike:
     """Class representing a moving spike"""
     def __init__(self, pos, variant, game, tile_size=16):
         self.pos = pos
+        self.prev_pos = list(pos)
         self.variant = variant
         self.game = game
         self.tile_size = tile_size
         self.dashing = False
         self.speed = 7
 
+    def trigger_zone(self, player_size):
+        """Returns the bounds (left, top, right, bottom) of the player centers that can start the movement"""
+        spike_center = (self.pos[0] + self.tile_size / 2, self.pos[1] + self.tile_size / 2)
+        half_width = self.tile_size / 2 + player_size[0] / 2
+        half_height = 3 * self.tile_size / 4 + player_size[1] / 2
+        match self.variant:
+            case 0: # up
+                return (spike_center[0] - half_width, spike_center[1] - 5 * self.tile_size, spike_center[0] + half_width, spike_center[1] + self.tile_size / 4)
+            case 1: # right
+                return (spike_center[0] - self.tile_size / 4, spike_center[1] - half_height, spike_center[0] + 5 * self.tile_size, spike_center[1] + half_height)
+            case 2: # down
+                return (spike_center[0] - half_width, spike_center[1] - self.tile_size / 4, spike_center[0] + half_width, spike_center[1] + 5 * self.tile_size)
+            case _: # left
+                return (spike_center[0] - 5 * self.tile_size, spike_center[1] - half_height, spike_center[0] + self.tile_size / 4, spike_center[1] + half_height)
+
+    def triggered(self, player_pos, player_size):
+        """Returns True if the player is in front of the spike so it should start moving"""
+        player_center = (player_pos[0] + player_size[0] / 2, player_pos[1] + player_size[1] / 2)
+        spike_center = (self.pos[0] + self.tile_size / 2, self.pos[1] + self.tile_size / 2)
+        match self.variant:
+            case 0: # up
+                return (abs(player_center[0] - spike_center[0]) < self.tile_size / 2 + player_size[0] / 2) and (-self.tile_size / 4 <= spike_center[1] - player_center[1] < 5 * self.tile_size)
+            case 1: # right
+                return (abs(player_center[1] - spike_center[1]) < 3 * self.tile_size / 4 + player_size[1] / 2) and (-self.tile_size / 4 < player_center[0] - spike_center[0] < 5 * self.tile_size)
+            case 2: # down
+                return (abs(player_center[0] - spike_center[0]) < self.tile_size / 2 + player_size[0] / 2) and (-self.tile_size / 4 < player_center[1] - spike_center[1] < 5 * self.tile_size)
+            case 3: # left
+                return (abs(player_center[1] - spike_center[1]) < 3 * self.tile_size / 4 + player_size[1] / 2) and (-self.tile_size / 4 < spike_center[0] - player_center[0] < 5 * self.tile_size)
+        return False
+
     def update(self, player_pos, player_size):
         """Updates position if moving, starts movement if not moving and player is around"""
         if not self.dashing:
-            player_center = (player_pos[0] + player_size[0] / 2, player_pos[1] + player_size[1] / 2)
-            spike_center = (self.pos[0] + self.tile_size / 2, self.pos[1] + self.tile_size / 2)
-            match self.variant:
-                case 0: # up
-                    if (abs(player_center[0] - spike_center[0]) < self.tile_size / 2 + player_size[0] / 2) and (-self.tile_size / 4 <= spike_center[1] - player_center[1] < 5 * self.tile_size):
-                        self.dashing = True
-                case 1: # right
-                    if (abs(player_center[1] - spike_center[1]) < 3 * self.tile_size / 4 + player_size[1] / 2) and (-self.tile_size / 4 < player_center[0] - spike_center[0] < 5 * self.tile_size):
-                        self.dashing = True
-                case 2: # down
-                    if (abs(player_center[0] - spike_center[0]) < self.tile_size / 2 + player_size[0] / 2) and (-self.tile_size / 4 < player_center[1] - spike_center[1] < 5 * self.tile_size):
-                        self.dashing = True
-                case 3: # left
-                    if (abs(player_center[1] - spike_center[1]) < 3 * self.tile_size / 4 + player_size[1] / 2) and (-self.tile_size / 4 < spike_center[0] - player_center[0] < 5 * self.tile_size):
-                        self.dashing = True
+            if self.triggered(player_pos, player_size):
+                self.dash()
         else:
-            match self.variant:
-                case 0: # up
-                    self.pos[1] -= self.speed
-                case 1: # right
-                    self.pos[0] += self.speed
-                case 2: # down
-                    self.pos[1] += self.speed
-                case 3: # left
-                    self.pos[0] -= self.speed
+            self.move()
 
-    def render(self, surf):
-        """Renders spike on surf"""
-        surf.blit(self.game.assets["textures"]["spikes"][self.variant], self.pos)
+    def dash(self):
+        """Starts the movement, the spike moves from the next tick"""
+        self.dashing = True
+        self.prev_pos = list(self.pos)
+
+    def move(self):
+        """Moves the dashing spike by its speed, the position before the move is kept in self.prev_pos"""
+        self.prev_pos = list(self.pos)
+        self.pos[0] += DIRECTIONS[self.variant][0] * self.speed
+        self.pos[1] += DIRECTIONS[self.variant][1] * self.speed
+
+    def render(self, surf, pos=None):
+        """Renders spike on surf, at pos instead of its position if given"""
+        surf.blit(self.game.assets["textures"]["spikes"][self.variant], self.pos if pos is None else pos)
 
     def rect(self):
         """Returns the rectangle of the spike"""
         return pygame.Rect(self.pos[0], self.pos[1], self.tile_size, self.tile_size)
 
     def mask(self):
-        """Returns the mask of the spike"""
-        return pygame.mask.from_surface(self.game.assets["textures"]["spikes"][self.variant])
+        """Returns the cached mask of the spike"""
+        return self.game.assets["masks"][("spikes", self.variant)]
+
+    def distance(self):
+        """Returns the distance in pixels the spike moved in the last tick"""
+        return int(abs(self.pos[0] - self.prev_pos[0]) + abs(self.pos[1] - self.prev_pos[1]))
+
+    def swept_rect(self):
+        """Returns the rectangle covered by the spike during the last tick"""
+        return pygame.Rect(min(self.pos[0], self.prev_pos[0]), min(self.pos[1], self.prev_pos[1]), self.tile_size + abs(self.pos[0] - self.prev_pos[0]), self.tile_size + abs(self.pos[1] - self.prev_pos[1]))
+
+    def swept_mask(self):
+        """Returns the cached mask covered by the spike during the last tick, anchored at the top left of swept_rect"""
+        distance = self.distance()
+        if not distance:
+            return self.mask()
+        masks = self.game.assets["masks"]
+        key = ("spikes/swept", self.variant, distance)
+        if key not in masks:
+            masks[key] = sweep_mask(self.mask(), DIRECTIONS[self.variant], distance)
+        return masks[key]
 
 class Block:
     """Class representing a disappearing block"""
@@ -64,6 +118,12 @@ class Block:
         self.game = game
         self.tile_size = tile_size
 
+    def trigger_zone(self, _player_size):
+        """Returns the bounds (left, top, right, bottom) of the player centers that make the block disappear, the same for any player size"""
+        radius = self.tile_size * 1.2
+        block_center = (self.pos[0] + self.tile_size / 2, self.pos[1] + self.tile_size / 2)
+        return (block_center[0] - radius, block_center[1] - radius, block_center[0] + radius, block_center[1] + radius)
+
     def update(self, player_pos, player_size):
         """Returns True if player is around so the block should disappear, returns False otherwise"""
         player_center = (player_pos[0] + player_size[0] / 2, player_pos[1] + player_size[1] / 2)
@@ -77,39 +137,112 @@ class Block:
         surf.blit(self.game.assets["textures"][self.type][self.variant], self.pos)
 
 class Traps:
-    """Class representing all the moving spikes and disappearing blocks of the game"""
+    """Class representing all the moving spikes and disappearing blocks of the game
+
+    Idle spikes and blocks are indexed by the TRAP_CELL_SIZE cells their trigger zones overlap,
+    each tick only the traps in the cell of the player center are tested. Triggered traps leave
+    self.idle but stay in the index. Dashing spikes are indexed by the cells their swept rects
+    of the last tick overlap in self.dashing_cells, rebuilt every tick as they move.
+    """
     def __init__(self, game, spikes, blocks):
         self.game = game
-        self.spikes = spikes
+        self.spikes = []
+        self.blocks = []
+        self.dashing = []
+        self.idle = set()
+        self.cells = None
+        self.index_size = None
+        self.dashing_cells = {}
+        self.reset(spikes, blocks)
+
+    def reset(self, spikes, blocks):
+        """Uses new spikes and blocks, spikes outside of the screen are dropped, the index is built on the next update"""
+        self.spikes = [spike for spike in spikes if not self.off_screen(spike)]
         self.blocks = blocks
+        self.dashing = [spike for spike in self.spikes if spike.dashing]
+        self.idle = {spike for spike in self.spikes if not spike.dashing} | set(blocks)
+        self.cells = None
+        self.index_size = None
+        self.index_dashing()
+
+    def restore(self, spikes):
+        """Replaces the spikes by restored ones (from the last reset) with their positions and dashing states, keeps the index"""
+        self.spikes = spikes
+        self.dashing = [spike for spike in spikes if spike.dashing]
+        self.idle = {spike for spike in spikes if not spike.dashing} | set(self.blocks)
+        self.index_dashing()
+
+    def build_index(self, player_size):
+        """Indexes the spikes and the blocks by the cells their trigger zones overlap for players of player_size"""
+        self.cells = {}
+        for trap in self.spikes + self.blocks:
+            left, top, right, bottom = trap.trigger_zone(player_size)
+            for cell in cells_overlapping(left, top, right, bottom):
+                self.cells.setdefault(cell, []).append(trap)
+        self.index_size = tuple(player_size)
+
+    def index_dashing(self):
+        """Indexes the dashing spikes by the cells their swept rects overlap"""
+        self.dashing_cells = {}
+        for spike in self.dashing:
+            rect = spike.swept_rect()
+            for cell in cells_overlapping(rect.left, rect.top, rect.right, rect.bottom):
+                self.dashing_cells.setdefault(cell, []).append(spike)
+
+    def off_screen(self, spike):
+        """Returns True if spike left the screen"""
+        return (
+            (spike.pos[0] < 0 - spike.tile_size)
+            or (spike.pos[1] < 0 - spike.tile_size)
+            or (spike.pos[0] > self.game.display_settings.display.get_width() + spike.tile_size)
+            or (spike.pos[1] > self.game.display_settings.display.get_height() + spike.tile_size)
+        )
 
     def update(self, player_pos, player_size):
         """Updates all traps"""
-        remove_indices = []
-        for i, spike in enumerate(self.spikes):
-            spike.update(player_pos, player_size)
-            if (
-                (spike.pos[0] < 0 - spike.tile_size)
-                or (spike.pos[1] < 0 - spike.tile_size)
-                or (spike.pos[0] > self.game.display_settings.display.get_width() + spike.tile_size)
-                or (spike.pos[1] > self.game.display_settings.display.get_height() + spike.tile_size)
-            ):
-                remove_indices.append(i)
-        for i in sorted(remove_indices, reverse=True):
-            self.spikes.pop(i)
-
-        remove_indices = []
-        for i, block in enumerate(self.blocks):
-            remove = block.update(player_pos, player_size)
-            if remove:
-                remove_indices.append(i)
-        for i in sorted(remove_indices, reverse=True):
-            self.blocks.pop(i)
+        if self.cells is None or self.index_size != tuple(player_size):
+            self.build_index(player_size)
 
-    def render(self, surf):
-        """Renders all traps on surf"""
+        if self.dashing:
+            for spike in self.dashing:
+                spike.move()
+            gone = [spike for spike in self.dashing if self.off_screen(spike)]
+            if gone:
+                self.dashing = [spike for spike in self.dashing if spike not in gone]
+                self.spikes = [spike for spike in self.spikes if spike not in gone]
+
+        player_center = (player_pos[0] + player_size[0] / 2, player_pos[1] + player_size[1] / 2)
+        cell = self.cells.get((int(player_center[0] // TRAP_CELL_SIZE), int(player_center[1] // TRAP_CELL_SIZE)), [])
+        for trap in cell:
+            if trap not in self.idle:
+                continue
+            if isinstance(trap, Spike):
+                if trap.triggered(player_pos, player_size):
+                    trap.dash()
+                    self.idle.discard(trap)
+                    self.dashing.append(trap)
+            elif trap.update(player_pos, player_size):
+                self.idle.discard(trap)
+                self.blocks.remove(trap)
+
+        if self.dashing or self.dashing_cells:
+            self.index_dashing()
+
+    def dashing_near(self, rect):
+        """Returns the dashing spikes whose swept rects of the last tick collide with rect"""
+        if not self.dashing_cells:
+            return []
+        near = []
+        for cell in cells_overlapping(rect.left, rect.top, rect.right, rect.bottom):
+            for spike in self.dashing_cells.get(cell, []):
+                if spike not in near and rect.colliderect(spike.swept_rect()):
+                    near.append(spike)
+        return near
+
+    def render(self, surf, place=None):
+        """Renders all traps on surf, place(spike, pos) returns the position to draw a spike at if given"""
         for spike in self.spikes:
-            spike.render(surf)
+            spike.render(surf, place(spike, spike.pos) if place else None)
 
         for block in self.blocks:
             block.render(surf)
@@ -1,31 +1,122 @@
 """
-File with utilities - image loading, animations
+File with utilities - image loading, texture atlas, collision masks, animations
 """
 import os
+import json
+import zlib
 import pygame
+from scripts.save import write_atomic
 
 BASE_IMG_PATH = "data/images/"
+# Atlas pixels are stored raw (RGBA), reading them is much cheaper than decoding a PNG
+ATLAS_IMAGE_PATH = "data/atlas.rgba"
+ATLAS_MANIFEST_PATH = "data/atlas.json"
+ATLAS_WIDTH = 512
+# Bumped when the way the atlas is built changes, older atlases are built again
+ATLAS_VERSION = 2
 
-def load_image(path, alpha=True):
-    """Loads image from path"""
-    if alpha:
-        img = pygame.image.load(BASE_IMG_PATH + path).convert_alpha()
-    else:
-        img = pygame.image.load(BASE_IMG_PATH + path).convert()
-        img.set_colorkey((0, 0, 0))
-    return img
-
-def load_images(path, alpha=True):
-    """Loads all images from directory path"""
-    images = []
-    for img_name in sorted(os.listdir(BASE_IMG_PATH + path)):
-        images.append(load_image(path + img_name, alpha=alpha))
-    return images
+def image_sources(path=""):
+    """Returns the modification time of every image in BASE_IMG_PATH + path keyed by its path relative to BASE_IMG_PATH"""
+    sources = {}
+    with os.scandir(BASE_IMG_PATH + path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                sources.update(image_sources(path + entry.name + "/"))
+            elif entry.name.endswith(".png"):
+                sources[path + entry.name] = entry.stat().st_mtime_ns
+    return sources
+
+def build_atlas(sources):
+    """Packs all images into one atlas image, writes it together with a manifest of their rects, returns both"""
+    images = {path: pygame.image.load(BASE_IMG_PATH + path) for path in sources}
+
+    # Shelf packing, tallest images first, 1 pixel gap between images
+    rects = {}
+    x, y, shelf_height = 0, 0, 0
+    for path in sorted(images, key=lambda path: (-images[path].get_height(), path)):
+        width, height = images[path].get_size()
+        if x + width > ATLAS_WIDTH:
+            x, y, shelf_height = 0, y + shelf_height + 1, 0
+        rects[path] = [x, y, width, height]
+        x += width + 1
+        shelf_height = max(shelf_height, height)
+
+    atlas = pygame.Surface((ATLAS_WIDTH, max(1, y + shelf_height)), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+    for path, rect in rects.items():
+        if images[path].get_flags() & pygame.SRCALPHA:
+            # The maximum with the transparent atlas copies the pixels, alpha blending would darken translucent ones
+            atlas.blit(images[path], rect[:2], special_flags=pygame.BLEND_RGBA_MAX)
+        else:
+            # Opaque and colorkeyed images, a plain blit copies the pixels and skips the colorkey
+            atlas.blit(images[path], rect[:2])
+    pixels = pygame.image.tobytes(atlas, "RGBA")
+    # Both files are replaced atomically, the checksum catches a manifest paired with the image of another build
+    manifest = {"version": ATLAS_VERSION, "size": atlas.get_size(), "sources": sources, "rects": rects, "crc32": zlib.crc32(pixels)}
+    write_atomic(ATLAS_IMAGE_PATH, pixels)
+    write_atomic(ATLAS_MANIFEST_PATH, json.dumps(manifest))
+    return manifest, atlas
+
+def load_atlas():
+    """Loads the texture atlas, builds it first if any image changed since it was built"""
+    sources = image_sources()
+    try:
+        with open(ATLAS_MANIFEST_PATH, "rt", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with open(ATLAS_IMAGE_PATH, "rb") as f:
+            pixels = f.read()
+        if manifest.get("version") == ATLAS_VERSION and manifest["sources"] == sources and manifest["crc32"] == zlib.crc32(pixels):
+            image = pygame.image.frombytes(pixels, manifest["size"], "RGBA")
+        else:
+            image = None
+    except (OSError, ValueError, KeyError):
+        image = None
+    if image is None:
+        manifest, image = build_atlas(sources)
+
+    if pygame.display.get_surface() is not None:
+        image = image.convert_alpha()
+    return Atlas(image, manifest["rects"])
+
+class Atlas:
+    """Class with all images of the game packed into a single texture"""
+    def __init__(self, image, rects):
+        self.image = image
+        self.rects = rects
+
+    def images(self, path):
+        """Returns the images in directory path, sorted by name, as subsurfaces of the atlas"""
+        names = sorted(name[len(path):] for name in self.rects if name.startswith(path) and "/" not in name[len(path):])
+        return [self.image.subsurface(self.rects[path + name]) for name in names]
+
+def build_masks(assets):
+    """Builds collision masks of all textures and animation frames keyed by (asset, variant/frame)
+
+    Collisions ignore which way a sprite faces, so only the unflipped images get masks.
+    """
+    masks = {}
+    sources = [(name, images) for name, images in assets["textures"].items()]
+    sources += [(name, animation.images) for name, animation in assets["animations"].items()]
+    for name, images in sources:
+        for i, img in enumerate(images):
+            masks[(name, i)] = pygame.mask.from_surface(img)
+    return masks
+
+def sweep_mask(mask, direction, distance):
+    """Returns the mask covered by mask moving distance pixels along direction (a unit axis vector), anchored at its top left corner"""
+    step = (abs(direction[0]), abs(direction[1]))
+    width, height = mask.get_size()
+    swept = pygame.mask.Mask((width + step[0] * distance, height + step[1] * distance))
+    for i in range(distance + 1):
+        swept.draw(mask, (step[0] * i, step[1] * i))
+    return swept
 
 class Animation:
     """Class with animations for entities"""
-    def __init__(self, images, img_dur=5, loop=True):
+    def __init__(self, images, img_dur=5, loop=True, flipped=None):
         self.images = images
+        # Left facing frames are flipped once here and shared by all copies
+        self.flipped = flipped if flipped is not None else [pygame.transform.flip(img, True, False) for img in images]
         self.loop = loop
         self.img_duration = img_dur
         self.done = False
@@ -33,7 +124,7 @@ class Animation:
 
     def copy(self):
         """Returns a copy of self"""
-        return Animation(self.images, self.img_duration, self.loop)
+        return Animation(self.images, self.img_duration, self.loop, flipped=self.flipped)
 
     def update(self):
         """Increases frame of the animation"""
@@ -44,6 +135,12 @@ class Animation:
             if self.frame >= self.img_duration * len(self.images) - 1:
                 self.done = True
 
-    def img(self):
-        """Returns the image of current frame of the animation"""
-        return self.images[int(self.frame / self.img_duration)]
+    def index(self):
+        """Returns the index of the image of current frame of the animation"""
+        return int(self.frame / self.img_duration)
+
+    def img(self, flip=False):
+        """Returns the image of current frame of the animation, flipped horizontally if flip is True"""
+        if flip:
+            return self.flipped[self.index()]
+        return self.images[self.index()]
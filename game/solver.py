@@ -0,0 +1,167 @@
+"""
+File with the level solvability checker, run from the game/ folder
+
+Every level is searched breadth-first from the spawner to the goal with the real headless game physics.
+The player holds one of the macro actions (left, none, right, each with or without a jump on the first tick)
+for a few ticks, states are deduplicated on the quantized player and trap state. A coarse search that runs
+out of states is repeated with the finer settings of SEARCH_PASSES. Levels are spread across a process pool,
+the shortest found tick count is reported for each of them.
+"""
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+# pylint: disable=wrong-import-position
+from game import Game, MAX_LEVEL, TICK_RATE
+from scripts.inputs import TickInput
+from scripts.utils import load_atlas
+
+MACRO_ACTIONS = [(move, jump) for jump in (False, True) for move in (1, 0, -1)]
+# Search settings tried from the coarsest - ticks a macro action is held for, pixels and velocity steps
+# merged into one state when deduplicating. Finer settings find more precise routes but search more states.
+SEARCH_PASSES = ((8, 8, 2), (4, 4, 1), (4, 2, 0.5))
+# Searched states of one pass after which it gives up
+MAX_STATES = 500_000
+
+def snapshot(game):
+    """Returns the state of the player and the traps, the tilemap of a level never changes"""
+    player = game.components.player
+    traps = game.components.traps
+    return (
+        tuple(player.transform.pos), tuple(player.transform.velocity), player.transform.flip,
+        player.air_time, player.jumps, player.dead, player.anim.action, player.anim.animation.frame,
+        tuple((spike, tuple(spike.pos), spike.dashing) for spike in traps.spikes),
+    )
+
+def restore(game, state):
+    """Restores the state of the player and the traps returned by snapshot"""
+    player = game.components.player
+    traps = game.components.traps
+    pos, velocity, flip, air_time, jumps, dead, action, frame, spikes = state
+    player.transform.pos = list(pos)
+    player.transform.velocity = list(velocity)
+    player.transform.flip = flip
+    player.air_time = air_time
+    player.jumps = jumps
+    player.dead = dead
+    player.set_action(action)
+    player.anim.animation.frame = frame
+    for spike, spike_pos, dashing in spikes:
+        spike.pos = list(spike_pos)
+        spike.dashing = dashing
+    traps.restore([spike for spike, _, _ in spikes])
+
+def state_key(state, spike_ids, position_quantum, velocity_quantum):
+    """Returns the quantized state used for deduplication"""
+    pos, velocity, _, air_time, jumps, _, _, _, spikes = state
+    return (
+        round(pos[0] / position_quantum), round(pos[1] / position_quantum), round(velocity[1] / velocity_quantum),
+        jumps, air_time > 4,
+        tuple((spike_ids[spike], dashing, round(spike_pos[0]), round(spike_pos[1])) for spike, spike_pos, dashing in spikes if dashing),
+        len(spikes),
+    )
+
+def start_level(game, level_id):
+    """Loads level level_id for searching, without the transition, the clouds and the disappearing blocks (they never touch the player)"""
+    game.current_state = "gameplay"
+    game.load_level(level_id)
+    game.display_settings.transition = 0
+    game.components.clouds.clouds = []
+    game.components.traps.reset(game.components.traps.spikes, [])
+
+def run_macro(game, action, macro_ticks):
+    """Holds action for macro_ticks ticks, returns the ticks run until the goal (None if not reached) and if the player died"""
+    move, jump = action
+    inputs = TickInput(movement=[move < 0, move > 0], jump=jump)
+    for tick in range(macro_ticks):
+        game.update_gameplay(inputs)
+        inputs.jump = False
+        if game.components.player.dead:
+            return None, True
+        if game.level_info.level_up:
+            return tick + 1, False
+    return None, False
+
+def search(game, level_id, macro_ticks, position_quantum, velocity_quantum, max_states=MAX_STATES):
+    """Searches level level_id breadth-first, returns the shortest found list of macro actions and its tick count (None, None if unsolved) and the number of searched states"""
+    start_level(game, level_id)
+    spike_ids = {spike: i for i, spike in enumerate(game.components.traps.spikes)}
+    start = snapshot(game)
+    start_key = state_key(start, spike_ids, position_quantum, velocity_quantum)
+    parents = {start_key: None}
+    queue = deque([(start, start_key)])
+    while queue and len(parents) < max_states:
+        state, key = queue.popleft()
+        for action in MACRO_ACTIONS:
+            restore(game, state)
+            goal_ticks, dead = run_macro(game, action, macro_ticks)
+            if dead:
+                continue
+            if goal_ticks is not None:
+                actions = [action]
+                while parents[key] is not None:
+                    key, parent_action = parents[key]
+                    actions.append(parent_action)
+                actions.reverse()
+                return actions, (len(actions) - 1) * macro_ticks + goal_ticks, len(parents)
+            new_state = snapshot(game)
+            new_key = state_key(new_state, spike_ids, position_quantum, velocity_quantum)
+            if new_key not in parents:
+                parents[new_key] = (key, action)
+                queue.append((new_state, new_key))
+    return None, None, len(parents)
+
+def replay_actions(game, level_id, actions, macro_ticks):
+    """Plays actions on a fresh start of level level_id, returns True if they reach the goal"""
+    start_level(game, level_id)
+    for action in actions:
+        goal_ticks, dead = run_macro(game, action, macro_ticks)
+        if dead:
+            return False
+        if goal_ticks is not None:
+            return True
+    return False
+
+def solve_level(level_id, passes=SEARCH_PASSES, max_states=MAX_STATES):
+    """Searches level level_id in a fresh headless game with finer passes until it is solved, returns a report of the search"""
+    start = time.perf_counter()
+    game = Game(headless=True, audio=False, seed=0)
+    report = {"level": level_id, "solved": False, "ticks": None, "actions": None, "macro_ticks": None, "states": 0}
+    for macro_ticks, position_quantum, velocity_quantum in passes:
+        actions, ticks, states = search(game, level_id, macro_ticks, position_quantum, velocity_quantum, max_states)
+        report["states"] += states
+        if actions is not None:
+            report.update(solved=True, ticks=ticks, actions=actions, macro_ticks=macro_ticks)
+            break
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+def main():
+    """Checks the levels given on the command line (all levels by default), returns 1 if any is unsolvable"""
+    parser = argparse.ArgumentParser(description="Troll Platformer level solvability checker")
+    parser.add_argument("levels", nargs="*", default=[str(level) for level in range(MAX_LEVEL + 1)], help="map file names without .json, e.g. 0 or test_maps/1")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--max-states", type=int, default=MAX_STATES, help="searched states per pass before giving up")
+    args = parser.parse_args()
+
+    unsolved = False
+    load_atlas()  # Built here once if out of date instead of in every worker
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(solve_level, level, SEARCH_PASSES, args.max_states) for level in args.levels]
+        for future in futures:
+            report = future.result()
+            if report["solved"]:
+                print(f"level {report['level']:12} solved in {report['ticks']:5} ticks ({report['ticks'] / TICK_RATE:.2f} s), {report['states']} states searched in {report['seconds']:.1f} s")
+            else:
+                unsolved = True
+                print(f"level {report['level']:12} UNSOLVED, {report['states']} states searched in {report['seconds']:.1f} s")
+    return 1 if unsolved else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
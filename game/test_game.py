@@ -1,14 +1,23 @@
 """
 File with tests
 """
+import os
 import json
+import time
+import shutil
 import pytest
 import pygame
 from scripts.entities import Player
 from scripts.tilemap import Tilemap
+from scripts.levels import compile_level, load_template, COMPILED_VERSION
+from scripts.replay import InputRecorder, load_recording, verify_replay
+from scripts.profiler import Profiler, NULL_SPAN
+from scripts.save import AutoSaver
+from scripts.utils import load_atlas
 from scripts.clouds import Cloud, Clouds
 from scripts.traps import Spike, Block, Traps
-from game import Game
+from game import Game, TickInput, SFX
+from solver import solve_level, replay_actions
 
 @pytest.fixture
 def game():
@@ -49,7 +58,7 @@ def test_collision_detection(game):
 
     # Create a floor tile
     floor_pos = (0, player.transform.pos[1] + player.transform.size[1])
-    tile_key = f"{floor_pos[0]//16};{floor_pos[1]//16}"
+    tile_key = (floor_pos[0]//16, floor_pos[1]//16)
     tilemap.tilemap[tile_key] = {
         "type": "grass",
         "variant": 0,
@@ -123,6 +132,7 @@ def test_level_loading(game):
     assert game.display_settings.transition == -30
     assert isinstance(game.components.player, Player)
     assert len(game.components.tilemap.tilemap) > 0
+    assert game.components.tilemap.solids is not None  # Merged solids are built with the level
 
 def test_animation_state(game):
     """Test player animation states"""
@@ -155,3 +165,627 @@ def test_transition_system(game):
     game.update_transition()
     assert game.display_settings.transition == -30
     assert not game.level_info.level_up
+
+def test_step_is_headless(game):
+    """Test that a simulation step advances gameplay without drawing"""
+    game.load_level(0)
+    game.current_state = "gameplay"
+    game.display_settings.transition = 0
+    game.display_settings.display.fill((1, 2, 3))
+    start_x = game.components.player.transform.pos[0]
+
+    for _ in range(30):
+        game.step(TickInput(movement=[False, True]))
+
+    assert game.level_info.time == 30
+    assert game.components.player.transform.pos[0] > start_x  # Player should walk right
+    assert game.display_settings.display.get_at((0, 0)) == (1, 2, 3)  # Nothing should be drawn
+
+def test_tilemap_baked_layer(game):
+    """Test that the tilemap bakes its tiles once and rebakes after invalidation"""
+    tilemap = game.components.tilemap
+    game.load_level(0)
+    surf = pygame.Surface((480, 400))
+    tilemap.render(surf)
+    layer = tilemap.layer
+    tilemap.render(surf)
+    assert tilemap.layer is layer  # Layer should be reused between frames
+
+    tilemap.autotile()
+    assert tilemap.layer is None  # Changing tiles should invalidate the layer
+
+    # Baked layer should look the same as blitting every tile
+    expected = pygame.Surface((480, 400))
+    for tile in tilemap.tilemap.values():
+        expected.blit(game.assets["textures"][tile["type"]][tile["variant"]], (tile["pos"][0] * 16, tile["pos"][1] * 16))
+    surf.fill((0, 0, 0))
+    tilemap.render(surf)
+    assert pygame.image.tobytes(surf, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+def test_tilemap_incremental_layer(game):
+    """Test that edits rebake only the touched chunks and the result matches a full bake"""
+    tilemap = game.components.tilemap
+    tilemap.load("test_maps/0.json")
+    tilemap.extract([("spawners", 0), ("spawners", 1)])  # The game has no spawner textures
+    surf = pygame.Surface((480, 400))
+    tilemap.render(surf)
+    layer = tilemap.layer
+
+    tilemap.set_tile((2, 2), {"type": "stone", "variant": 1, "pos": [2, 2]})
+    tilemap.remove_tile(next(loc for loc in tilemap.tilemap if loc[0] > 16))
+    offgrid = {"type": "grass", "variant": 0, "pos": [250.5, 120.0]}  # Crosses a chunk border
+    tilemap.add_offgrid(offgrid)
+    assert tilemap.layer is layer and tilemap.dirty  # Only marked, not discarded
+    assert tilemap.offgrid_at((260, 130)) == [offgrid] and not tilemap.offgrid_at((240, 130))
+    assert list(tilemap.offgrid_hits[(16, 7)].values()) == [offgrid] and (14, 7) not in tilemap.offgrid_hits  # Tile size cells
+    stacked = dict(offgrid)  # Offgrid tiles can share a position
+    tilemap.add_offgrid(stacked)
+    assert tilemap.offgrid_at((260, 130)) == [offgrid, stacked]
+    tilemap.remove_offgrid(stacked)
+    surf.fill((0, 0, 0))
+    tilemap.render(surf)
+    assert not tilemap.dirty
+
+    expected = pygame.Surface((480, 400))
+    tilemap.invalidate()
+    tilemap.render(expected)
+    assert pygame.image.tobytes(surf, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+    tilemap.remove_offgrid(offgrid)
+    assert not tilemap.offgrid_at((260, 130)) and offgrid not in tilemap.offgrid_tiles.values()
+    surf.fill((0, 0, 0))
+    tilemap.render(surf)
+    tilemap.invalidate()
+    expected.fill((0, 0, 0))
+    tilemap.render(expected)
+    assert pygame.image.tobytes(surf, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+def test_tilemap_incremental_layer_tile_sizes(game):
+    """Test that edits match a full bake when grid tiles cross chunk borders or reach past their cells"""
+    for tile_size in (24, 8):  # 24 does not divide the chunk size, 16 px textures are larger than 8 px cells
+        tilemap = Tilemap(game, tile_size=tile_size)
+        cells = [(x, y) for x in range(224 // tile_size, 296 // tile_size) for y in range(5, 9)]
+        tilemap.tilemap = {loc: {"type": "grass", "variant": 4, "pos": list(loc)} for loc in cells}
+        surf = pygame.Surface((480, 400))
+        tilemap.render(surf)
+
+        for loc in cells[::5]:
+            tilemap.set_tile(loc, {"type": "stone", "variant": 1, "pos": list(loc)})
+        for loc in cells[2::7]:
+            tilemap.remove_tile(loc)
+        surf.fill((0, 0, 0))
+        tilemap.render(surf)
+
+        expected = pygame.Surface((480, 400))
+        tilemap.invalidate()
+        tilemap.render(expected)
+        assert pygame.image.tobytes(surf, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+def test_tilemap_incremental_autotile(game):
+    """Test that autotiling the edited cells gives the same variants as autotiling the whole map"""
+    tilemap = game.components.tilemap
+    tilemap.tilemap = {(x, y): {"type": "grass", "variant": 0, "pos": [x, y]} for x in range(2, 8) for y in range(3, 6)}
+    tilemap.tilemap[(4, 3)]["variant"] = 10  # Disappearing block
+    tilemap.autotile()
+    assert tilemap.tilemap[(2, 3)]["variant"] == 0 and tilemap.tilemap[(5, 4)]["variant"] == 4
+    assert tilemap.tilemap[(4, 3)]["variant"] == 10  # Should stay a disappearing block
+    surf = pygame.Surface((480, 400))
+    tilemap.render(surf)
+    layer = tilemap.layer
+
+    tilemap.set_tile((5, 2), {"type": "grass", "variant": 0, "pos": [5, 2]})
+    tilemap.autotile([(5, 2)])
+    tilemap.remove_tile((3, 4))
+    tilemap.autotile([(3, 4)])
+    assert tilemap.layer is layer and tilemap.dirty  # Only marked, not discarded
+    assert tilemap.tilemap[(5, 3)]["variant"] == 4 and tilemap.tilemap[(3, 3)]["variant"] == 1
+
+    variants = {loc: tile["variant"] for loc, tile in tilemap.tilemap.items()}
+    tilemap.autotile()
+    assert variants == {loc: tile["variant"] for loc, tile in tilemap.tilemap.items()}
+
+def test_tilemap_tuple_keys(game, tmp_path, monkeypatch):
+    """Test that tiles are keyed by tuples in memory and by strings on disk"""
+    tilemap = game.components.tilemap
+    tilemap.load("test_maps/0.json")
+    for loc, tile in tilemap.tilemap.items():
+        assert loc == tuple(tile["pos"])
+
+    # Saving should keep the "x;y" format of the map files
+    monkeypatch.setattr("scripts.tilemap.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    tilemap.save("saved.json")
+    with open(tmp_path / "saved.json", "rt", encoding="utf-8") as f:
+        saved = json.load(f)
+    assert all(";" in loc for loc in saved["tilemap"])
+
+    tiles = dict(tilemap.tilemap)
+    tilemap.load("saved.json")
+    assert tilemap.tilemap == tiles
+
+def test_merged_solid_rects(game):
+    """Test that solid tiles are merged into few rects that also stop entities larger than a tile"""
+    tilemap = Tilemap(game)
+    floor = {(x, 10): {"type": "grass", "variant": 1, "pos": [x, 10]} for x in range(2, 12)}
+    wall = {(2, y): {"type": "stone", "variant": 1, "pos": [2, y]} for y in range(6, 10)}
+    tilemap.tilemap = {**floor, **wall, (6, 9): {"type": "goal", "variant": 0, "pos": [6, 9]}}
+    assert sorted(tilemap.merge_solids()) == [pygame.Rect(32, 96, 16, 80), pygame.Rect(48, 160, 144, 16)]
+    assert tilemap.physics_rects_near(pygame.Rect(100, 150, 13, 16)) == [pygame.Rect(48, 160, 144, 16)]
+
+    # The floor tile under the right edge is farther than the 3x3 tiles around the top left corner
+    big_player = Player(game, (4 * 16, 100), (48, 48))
+    tilemap.tilemap = {(6, 10): {"type": "grass", "variant": 1, "pos": [6, 10]}}
+    tilemap.invalidate()
+    for _ in range(60):
+        big_player.update(tilemap)
+    assert big_player.transform.pos[1] == 10 * 16 - 48
+    assert big_player.collision.down
+
+def test_trap_trigger_index(game):
+    """Test that only the traps whose trigger zones contain the player react and dashing spikes are found near the player"""
+    near_spike = Spike([100, 100], 0, game)
+    far_spike = Spike([400, 100], 0, game)
+    near_block = Block([100, 45], ("grass", 0), game)
+    far_block = Block([400, 300], ("grass", 0), game)
+    outside_spike = Spike([-100, 100], 1, game)
+    traps = Traps(game, [near_spike, far_spike, outside_spike], [near_block, far_block])
+    assert traps.spikes == [near_spike, far_spike]  # Idle spikes outside of the screen are dropped
+    traps.update([100, 50], (13, 16))
+    assert traps.dashing == [near_spike] and not far_spike.dashing
+    assert traps.blocks == [far_block]
+    assert traps.cells is not None and far_spike not in traps.cells[(1, 1)]
+
+    traps.update([100, 50], (13, 16))
+    assert near_spike.pos == [100, 93]  # Moves from the tick after it was triggered
+    assert traps.dashing_near(pygame.Rect(100, 80, 13, 16)) == [near_spike]
+    assert traps.dashing_cells == {(1, 1): [near_spike]}  # Dashing spikes are found through their cells
+    assert not traps.dashing_near(pygame.Rect(300, 80, 13, 16))
+
+def test_swept_spike_collision(game):
+    """Test that a spike passing through the player in one tick kills the player"""
+    player = game.components.player
+    player.transform.pos = [100, 50]
+    spike = Spike([100, 90], 0, game)  # Upward facing spike below the player
+    spike.speed = 60
+    spike.dash()
+    traps = Traps(game, [spike], [])
+    traps.update(player.transform.pos, player.transform.size)
+    assert spike.pos == [100, 30] and not spike.rect().colliderect(player.rect())  # Ends up above the player
+    assert spike.swept_rect() == pygame.Rect(100, 30, 16, 76)
+
+    player.check_dynamic_spike_collision(traps)
+    assert player.dead
+    assert spike.swept_mask() is game.assets["masks"][("spikes/swept", 0, 60)]  # Swept masks are cached
+
+def test_swept_spike_behind_player(game):
+    """Test that a spike passing a spot the player only reaches later in the tick does not kill the player"""
+    player = game.components.player
+    spike = Spike([100, 0], 0, game)  # Moved up from y 60 during the tick
+    spike.dashing = True
+    spike.prev_pos = [100, 60]
+    traps = Traps(game, [spike], [])
+    traps.index_dashing()
+
+    player.transform.pos = [92, 50]  # Walked right from x 80 into the column after the spike left the player's rows
+    player.check_dynamic_spike_collision(traps, [80, 50])
+    assert not player.dead
+
+    player.transform.pos = [100, 50]  # Already in the column when the spike passed
+    player.check_dynamic_spike_collision(traps, [99, 50])
+    assert player.dead
+
+def test_cached_masks(game):
+    """Test that collision masks come from the cache built at asset load"""
+    spike = Spike([100, 100], 1, game)
+    assert spike.mask() is spike.mask()  # Spike mask should not be rebuilt
+
+    player = game.components.player
+    frame_mask = pygame.mask.from_surface(player.anim.animation.img())
+    player.transform.flip = True
+    assert player.mask().overlap_area(frame_mask, (0, 0)) == frame_mask.count() == player.mask().count()  # The hitbox should not follow the facing direction
+
+def test_animation_flipped_frames(game):
+    """Test that flipped animation frames are precomputed and shared"""
+    source = game.assets["animations"]["player/walk"]
+    animation = source.copy()
+    assert animation.flipped is source.flipped  # Copies should share the flipped frames
+    assert animation.img(True) is animation.img(True)  # No new surface per frame
+    assert animation.img(True).get_at((0, 0)) == animation.img().get_at((animation.img().get_width() - 1, 0))
+
+def test_text_cache(game):
+    """Test that outlined text is rendered once and then reused"""
+    surf = pygame.Surface((200, 50))
+    game.draw_text(surf, "deaths: 3", (5, 5), size="small")
+    game.draw_text(surf, "deaths: 3", (5, 5), size="small")
+    assert game.text_cache.misses == 1
+    assert game.text_cache.hits == 1
+
+    # Cached text should look the same as rendering fill and outline directly
+    expected = pygame.Surface((200, 50))
+    font = game.assets["fonts"]["small"]
+    for shift in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+        expected.blit(font.render("deaths: 3", False, (0, 0, 0)), (5 + shift[0], 5 + shift[1]))
+    expected.blit(font.render("deaths: 3", False, (255, 255, 255)), (5, 5))
+    assert pygame.image.tobytes(surf, "RGB") == pygame.image.tobytes(expected, "RGB")
+
+    # Cache should stay bounded
+    game.text_cache.max_size = 4
+    for i in range(10):
+        game.draw_text(surf, str(i), (0, 0))
+    assert len(game.text_cache.surfaces) == 4
+
+def test_menu_redraw_on_change(game):
+    """Test that the main menu is only redrawn when something changed"""
+    game.display_settings.transition = 0
+    assert game.draw_menu() is None  # First frame is drawn whole
+    assert game.draw_menu() == []  # Nothing changed, nothing to show
+
+    # Moving the highlight only updates the two slots
+    old_slot = game.level_info.current_slot
+    game.level_info.current_slot = 3
+    assert game.draw_menu() == [game.display_settings.slot_rects[old_slot], game.display_settings.slot_rects[3]]
+
+    game.level_info.data["slot1"]["deaths"] += 1
+    assert game.draw_menu() is None
+
+def test_transition_frames(game):
+    """Test that transition frames are rendered once and look like the transition circle"""
+    frames = game.transition_frames
+    assert frames.get(-12) is frames.get(12)  # Opening and closing share frames
+
+    surf = pygame.Surface(game.display_settings.display.get_size())
+    surf.fill((255, 0, 0))
+    frames.render(surf, 20)
+    assert surf.get_at((0, 0)) == (0, 0, 0)  # Corners are covered
+    assert surf.get_at((surf.get_width() // 2, surf.get_height() // 2)) == (255, 0, 0)  # Middle is visible
+    assert len(frames.frames) == 2
+
+def test_present_scales_into_window(game):
+    """Test that presenting scales the display straight into the window"""
+    game.display_settings.display.fill((10, 20, 30))
+    game.display_settings.display.set_at((0, 0), (200, 0, 0))
+    game.present()
+    screen = game.display_settings.screen
+    assert screen.get_at((1, 1)) == (200, 0, 0)
+    assert screen.get_at((screen.get_width() - 1, screen.get_height() - 1)) == (10, 20, 30)
+
+    # Integer scaling keeps a whole multiple of the display size
+    game.display_settings.scaling = "integer"
+    game.setup_presentation()
+    assert game.display_settings.target.get_width() % game.display_settings.display.get_width() == 0
+
+def test_fixed_timestep(game):
+    """Test that the simulation runs fixed ticks independent of the frame time"""
+    game.current_state = "gameplay"
+    game.load_level(0)
+    assert game.advance(1 / 120) == 0  # Half a tick is not enough
+    assert game.advance(1 / 120) == 1
+    assert game.advance(1.0) == 5  # Long hitch is capped
+    assert game.display_settings.accumulator < 1 / 60
+    assert game.level_info.time == 6
+
+def test_interpolated_frames():
+    """Test that uncapped frames draw the player between its positions of the last two ticks"""
+    fast_game = Game(headless=True, audio=False, max_fps=0)
+    fast_game.current_state = "gameplay"
+    fast_game.load_level(0)
+    fast_game.display_settings.transition = 0
+    fast_game.inputs.movement = [False, True]
+    fast_game.advance(1 / 60)
+    player = fast_game.components.player
+    start = fast_game.display_settings.previous[player]
+    assert player.transform.pos[0] > start[0]
+
+    fast_game.advance(1 / 120)  # Half of the next tick
+    assert fast_game.interpolated(player, player.transform.pos)[0] == pytest.approx((start[0] + player.transform.pos[0]) / 2)
+    assert fast_game.draw_gameplay() is None
+    fast_game.advance(1 / 480)
+    assert fast_game.draw_gameplay() is None  # Every frame shows something new
+
+    assert not Game(headless=True, audio=False).display_settings.interpolate  # Not needed at the tick rate
+    pygame.quit()
+
+def test_level_template_restart(game):
+    """Test that restarting a level reuses its compiled template"""
+    game.load_level(4)
+    template = game.level_templates[4]
+    tiles = game.components.tilemap.tilemap
+    game.components.traps.spikes[0].pos[1] -= 50  # Move a spike as if it was dashing
+
+    game.load_level(4)
+    assert game.level_templates[4] is template
+    assert game.components.tilemap.tilemap is tiles  # Static tiles are shared, not parsed again
+    assert game.components.traps.spikes[0].pos == list(template.spikes[0][0])  # Traps are fresh
+    assert game.components.player.transform.pos == list(template.spawn[0])
+
+def test_level_template_copy_on_write(game):
+    """Test that changing the tiles of a loaded level copies them instead of changing the template"""
+    game.load_level(4)
+    template = game.level_templates[4]
+    tilemap = game.components.tilemap
+    loc, tile = next(iter(template.tilemap.items()))
+    with pytest.raises(TypeError):
+        tile["variant"] = 3  # Template tiles are read-only
+
+    variants = {loc: tile["variant"] for loc, tile in template.tilemap.items()}
+    tilemap.autotile()
+    tilemap.remove_tile(loc)
+    tilemap.set_tile((0, 0), {"type": "stone", "variant": 0, "pos": [0, 0]})
+    tilemap.extract([("grass", 1)])
+    assert tilemap.tilemap is not template.tilemap and loc not in tilemap.tilemap
+    assert {loc: tile["variant"] for loc, tile in template.tilemap.items()} == variants
+
+    game.load_level(4)
+    assert tilemap.tilemap is template.tilemap  # Restarting should bring the level back
+
+def test_compiled_level_cache(game, tmp_path, monkeypatch):
+    """Test that compiled levels match the map file and are rebuilt when it changes"""
+    monkeypatch.setattr("scripts.tilemap.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    monkeypatch.setattr("scripts.levels.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    shutil.copy("data/maps/4.json", tmp_path / "4.json")
+
+    expected = compile_level("4.json")
+    load_template("4.json")
+    assert (tmp_path / "4.lvl").exists()
+    template = load_template("4.json")
+    assert dict(template.tilemap) == dict(expected.tilemap)
+    assert template.offgrid_tiles == expected.offgrid_tiles
+    assert (template.spawn, template.spikes, template.blocks) == (expected.spawn, expected.spikes, expected.blocks)
+    # Both paths should give the same types too (ints for traps, floats for offgrid tiles)
+    assert repr((template.spawn, template.spikes, template.blocks, template.offgrid_tiles)) == repr((expected.spawn, expected.spikes, expected.blocks, expected.offgrid_tiles))
+    assert sorted(os.listdir(tmp_path)) == ["4.json", "4.lvl"]  # No temporary files should be left
+
+    # Changing the map file should invalidate the compiled level
+    with open(tmp_path / "4.json", "rt", encoding="utf-8") as f:
+        map_data = json.load(f)
+    map_data["tilemap"] = {}
+    with open(tmp_path / "4.json", "wt", encoding="utf-8") as f:
+        json.dump(map_data, f)
+    os.utime(tmp_path / "4.json", ns=(0, 0))
+    assert len(load_template("4.json").tilemap) == 0
+
+def test_compiled_level_corrupt(game, tmp_path, monkeypatch):
+    """Test that compiled levels of another version or truncated ones are compiled again"""
+    monkeypatch.setattr("scripts.tilemap.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    monkeypatch.setattr("scripts.levels.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    shutil.copy("data/maps/0.json", tmp_path / "0.json")
+    expected = compile_level("0.json")
+    load_template("0.json")
+    compiled = (tmp_path / "0.lvl").read_bytes()
+
+    stale = compiled[:4] + (COMPILED_VERSION + 1).to_bytes(2, "little") + compiled[6:]
+    for data in (stale, compiled[:30]):
+        (tmp_path / "0.lvl").write_bytes(data)
+        assert dict(load_template("0.json").tilemap) == dict(expected.tilemap)
+        assert (tmp_path / "0.lvl").read_bytes() == compiled  # Should be written again
+
+def test_texture_atlas(game):
+    """Test that textures from the atlas match the image files"""
+    textures = [(game.assets["textures"]["spikes"][3], "tiles/spikes/3.png"), (game.assets["textures"]["clouds"][1], "clouds/1.png"), (game.assets["animations"]["player/walk"].images[1], "entities/player/walk/1.png")]
+    for texture, path in textures:
+        assert texture.get_parent() is not None  # Textures should be parts of one atlas
+        expected = pygame.image.load("data/images/" + path).convert_alpha()
+        assert texture.get_size() == expected.get_size()
+        for x in range(texture.get_width()):
+            for y in range(texture.get_height()):
+                if expected.get_at((x, y)).a:
+                    assert texture.get_at((x, y)) == expected.get_at((x, y))
+                else:
+                    assert texture.get_at((x, y)).a == 0
+
+def test_texture_atlas_build(tmp_path, monkeypatch):
+    """Test that the atlas copies translucent pixels exactly and is written atomically"""
+    monkeypatch.setattr("scripts.utils.BASE_IMG_PATH", str(tmp_path / "images") + "/")
+    monkeypatch.setattr("scripts.utils.ATLAS_IMAGE_PATH", str(tmp_path / "atlas.rgba"))
+    monkeypatch.setattr("scripts.utils.ATLAS_MANIFEST_PATH", str(tmp_path / "atlas.json"))
+    (tmp_path / "images" / "tiles").mkdir(parents=True)
+    img = pygame.Surface((4, 4), pygame.SRCALPHA)
+    img.fill((200, 100, 50, 128))
+    pygame.image.save(img, str(tmp_path / "images" / "tiles" / "0.png"))
+
+    for _ in range(2):  # Built on the first load, read from the files on the second
+        texture = load_atlas().images("tiles/")[0]
+        assert texture.get_at((1, 1)) == (200, 100, 50, 128)
+    assert sorted(os.listdir(tmp_path)) == ["atlas.json", "atlas.rgba", "images"]
+
+    # An image from another build should not be paired with the manifest
+    (tmp_path / "atlas.rgba").write_bytes(bytes(len((tmp_path / "atlas.rgba").read_bytes())))
+    assert load_atlas().images("tiles/")[0].get_at((1, 1)) == (200, 100, 50, 128)
+
+def test_headless_lazy_assets():
+    """Test that a headless game has no window, no audio and loads sounds and fonts lazily"""
+    headless_game = Game(headless=True, audio=False)
+    assert headless_game.display_settings.screen is None
+    assert not headless_game.assets["sfx"].loaded  # Nothing loaded before first access
+    assert not headless_game.assets["fonts"].loaded
+
+    headless_game.assets["sfx"]["jump"].play()  # Silent sounds can be played
+    headless_game.present(headless_game.draw())  # Drawing works without a window
+    assert "medium" in headless_game.assets["fonts"].loaded
+    assert "init" in headless_game.startup.phases
+    pygame.quit()
+
+def test_preload_reads_only_files():
+    """Test that the preload thread creates no pygame sounds or fonts, sounds are built from the preloaded bytes"""
+    pygame.mixer.init()
+    audio_game = Game(headless=True)
+    audio_game.preload_assets()
+    assert not audio_game.assets["sfx"].loaded and not audio_game.assets["fonts"].loaded
+    if audio_game.audio:
+        assert set(audio_game.sound_data) == {path for path, _volume in SFX.values()}
+        assert audio_game.assets["sfx"]["jump"].get_length() > 0
+    pygame.quit()
+
+def test_record_and_replay(tmp_path):
+    """Test that a recorded run replays to the bit-identical final state"""
+    recorded_game = Game(headless=True, audio=False, seed=7)
+    recorded_game.recorder = InputRecorder(recorded_game.seed, tmp_path / "run.json")
+    recorded_game.display_settings.transition = 0
+    recorded_game.level_info.start_game = True
+    for tick in range(600):
+        recorded_game.step(TickInput(movement=[tick % 200 > 150, tick % 200 < 120], jump=tick % 45 == 0, restart=tick == 400))
+    recorded_game.recorder.save(recorded_game)
+    assert recorded_game.current_state == "gameplay"
+
+    recording = load_recording(tmp_path / "run.json")
+    assert len(recording["inputs"]) == 600
+    replayed_game = Game(headless=True, audio=False, seed=recording["seed"])
+    verify_replay(replayed_game, recording)
+    assert replayed_game.components.clouds.clouds[0].pos == recorded_game.components.clouds.clouds[0].pos
+
+    # A different outcome should be reported
+    recording["final"]["deaths"] += 1
+    with pytest.raises(AssertionError):
+        verify_replay(Game(headless=True, audio=False, seed=recording["seed"]), recording)
+
+def test_record_past_end_screen(tmp_path, monkeypatch):
+    """Test that a run continued past the end screen replays to the state the recording finished in"""
+    monkeypatch.setattr("scripts.tilemap.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    monkeypatch.setattr("scripts.levels.BASE_TILEMAP_PATH", str(tmp_path) + "/")
+    shutil.copy("data/maps/test_maps/2.json", tmp_path / "4.json")  # A short last level
+    report = solve_level("4", passes=[(8, 8, 2)])
+
+    recorded_game = Game(headless=True, audio=False, seed=7)
+    recorded_game.recorder = InputRecorder(recorded_game.seed, tmp_path / "run.json")
+    recorded_game.level_info.data["slot1"] = {"level": 4, "time": 0, "deaths": 0}
+    recorded_game.level_info.current_slot = 1
+    recorded_game.display_settings.transition = 0
+    recorded_game.level_info.start_game = True
+    while recorded_game.current_state != "gameplay" or recorded_game.display_settings.transition:
+        recorded_game.step(TickInput())
+    for move, jump in report["actions"]:
+        for tick in range(report["macro_ticks"]):
+            recorded_game.step(TickInput(movement=[move < 0, move > 0], jump=jump and tick == 0))
+    while recorded_game.current_state != "end_screen":
+        recorded_game.step(TickInput())
+    recorded_game.level_info.restart_game = True  # Space on the end screen
+    while recorded_game.current_state != "main_menu":
+        recorded_game.step(TickInput())
+    recorded_game.recorder.save(recorded_game)
+
+    recording = load_recording(tmp_path / "run.json")
+    assert recording["final"]["state"] == "end_screen"
+    verify_replay(Game(headless=True, audio=False, seed=recording["seed"]), recording)
+
+def test_span_profiler(tmp_path):
+    """Test that the profiler records nothing when disabled and exports spans as Chrome trace events"""
+    assert Profiler().span("draw") is NULL_SPAN
+
+    profiled_game = Game(headless=True, audio=False, profile=tmp_path / "trace.json")
+    profiled_game.current_state = "gameplay"
+    profiled_game.display_settings.transition = 0
+    profiled_game.step(TickInput(movement=[False, True]))
+    profiled_game.draw()
+    profiled_game.profiler.dump()
+    with open(tmp_path / "trace.json", "rt", encoding="utf-8") as f:
+        events = json.load(f)["traceEvents"]
+    names = {event["name"] for event in events}
+    assert {"update_transition", "player.update", "tilemap", "player", "text"} <= names
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+    ring = Profiler("unused", capacity=3)
+    for name in "abcde":
+        with ring.span(name):
+            pass
+    assert [event["name"] for event in ring.trace()["traceEvents"]] == ["c", "d", "e"]
+    pygame.quit()
+
+def test_benchmark_map():
+    """Test that a benchmarked map keeps an int level number through deaths and reports the subsystem timings"""
+    import benchmark  # pylint: disable=import-outside-toplevel
+    bench_game = Game(headless=True, audio=False, seed=0)
+    results = benchmark.bench_map(bench_game, "test_maps/0", ticks=600, frames=2)
+    assert set(benchmark.SUBSYSTEM_SPANS) <= set(results) and results["player_update_ms"] > 0
+    assert bench_game.level_info.level == benchmark.BENCH_LEVEL and not bench_game.profiler.enabled
+    deaths = bench_game.level_info.deaths
+    bench_game.components.player.dead = 10
+    for _ in range(40):
+        bench_game.step(TickInput())
+    assert bench_game.level_info.level == benchmark.BENCH_LEVEL and bench_game.level_info.deaths == deaths + 1
+    pygame.quit()
+
+def test_level_solver():
+    """Test that the solver finds a route to the goal that replays in the game"""
+    report = solve_level("test_maps/2", passes=[(8, 8, 2)])
+    assert report["solved"]
+    assert 0 < report["ticks"] <= len(report["actions"]) * 8
+    solver_game = Game(headless=True, audio=False, seed=0)
+    assert replay_actions(solver_game, "test_maps/2", report["actions"], report["macro_ticks"])
+    assert not replay_actions(solver_game, "test_maps/2", [(0, False)], report["macro_ticks"])
+    pygame.quit()
+
+def test_batch_physics_matches_player():
+    """Test that the batched physics moves every player exactly like the scalar Player, tick for tick"""
+    np = pytest.importorskip("numpy")
+    from scripts.batch import BatchPhysics  # pylint: disable=import-outside-toplevel
+    batch_game = Game(headless=True, audio=False, seed=0)
+    batch_game.load_level("test_maps/0")
+    tilemap = batch_game.components.tilemap
+    spawn = batch_game.components.player.transform.pos
+    inputs = [(-1, 0, 1, 1, 0, -1)[tick // 25 % 6] for tick in range(300)]
+    players = [Player(batch_game, spawn, (13, 16)) for _ in range(6)]
+    batch = BatchPhysics(tilemap, len(players), spawn=spawn)
+    for tick in range(300):
+        # Every player gets the same inputs shifted in time
+        movement = [inputs[(tick + 40 * i) % 300] for i in range(len(players))]
+        jumping = [(tick + 7 * i) % 30 == 0 for i in range(len(players))]
+        batch.update(np.array(movement), np.array(jumping))
+        for i, player in enumerate(players):
+            if player.dead:
+                continue
+            if jumping[i]:
+                player.jump()
+            player.update(tilemap, (movement[i], 0))
+            if player.dead and not batch.dead[i]:
+                continue  # Spikes are not simulated by the batch
+            assert tuple(player.transform.pos) == tuple(batch.pos[i])
+            assert player.transform.velocity[1] == batch.velocity[i, 1]
+            assert (player.jumps, player.air_time, bool(player.dead)) == (batch.jumps[i], batch.air_time[i], batch.dead[i])
+    pygame.quit()
+
+def test_autosave_write_failure(tmp_path):
+    """Test that a failed autosave leaves no temporary file and later autosaves are still written"""
+    (tmp_path / "save.json").mkdir()  # Renaming over a directory fails even for root, unlike permissions
+    saver = AutoSaver(tmp_path / "save.json")
+    saver.submit({"slot1": {"level": 1}})
+    for _ in range(500):
+        if saver.failures:
+            break
+        time.sleep(0.01)
+    assert saver.failures == 1 and isinstance(saver.error, OSError)
+    assert os.listdir(tmp_path) == ["save.json"]
+
+    (tmp_path / "save.json").rmdir()
+    saver.submit({"slot1": {"level": 2}})
+    saver.close()
+    assert saver.writes == 1
+    with open(tmp_path / "save.json", "rt", encoding="utf-8") as f:
+        assert json.load(f) == {"slot1": {"level": 2}}
+
+def test_background_autosave(tmp_path):
+    """Test that autosaves write the newest snapshot atomically and are triggered by deaths"""
+    saver = AutoSaver(tmp_path / "save.json")
+    data = {"slot1": {"level": 0}}
+    with saver.condition:  # Hold the writer back so the snapshots pile up
+        for level in range(5):
+            data["slot1"]["level"] = level
+            saver.submit(data)
+    data["slot1"]["level"] = 99  # Later changes are not part of the snapshot
+    saver.close()
+    assert saver.writes == 1
+    with open(tmp_path / "save.json", "rt", encoding="utf-8") as f:
+        assert json.load(f) == {"slot1": {"level": 4}}
+    assert os.listdir(tmp_path) == ["save.json"]  # The temporary file was renamed
+
+    autosave_game = Game(headless=True, audio=False)
+    autosave_game.autosaver = AutoSaver(tmp_path / "game.json")
+    autosave_game.current_state = "gameplay"
+    autosave_game.load_level(0)
+    autosave_game.display_settings.transition = 0
+    autosave_game.level_info.deaths = 0
+    autosave_game.components.player.dead = 1
+    for _ in range(50):
+        autosave_game.step(TickInput())
+    autosave_game.autosaver.close()
+    with open(tmp_path / "game.json", "rt", encoding="utf-8") as f:
+        assert json.load(f)["slot2"]["deaths"] == 1
+    pygame.quit()